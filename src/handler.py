@@ -1,16 +1,19 @@
 """
 Module to handle create, update, delete on CR
 """
-from time import sleep
-
+import asyncio
+import datetime
+import functools
 import kopf
 import logging
 import os
 
 from kubernetes import config as k8s_config
+from kubernetes.client.rest import ApiException
 
 import mistral_constants as MC
 from kubernetes_helper import KubernetesHelper
+from switchover_lane import get_switchover_lane, get_switchover_metrics
 
 logging.basicConfig(
     filename='/proc/1/fd/1',
@@ -27,7 +30,6 @@ logger.info('OPERATOR_DELETE_RESOURCES is set '
             'to %s', MC.OPERATOR_NEED_TO_DELETE_RESOURCES)
 
 OPTIONAL_DELETE = True
-FORCED_UPGRADE = True
 if MC.OPERATOR_NEED_TO_DELETE_RESOURCES in MC.POSITIVE_VALUES:
     OPTIONAL_DELETE = False
 
@@ -41,69 +43,99 @@ except k8s_config.ConfigException:
         "This script is intended to use inside of kubernetes")
     sys.exit(1)
 
-# Code to handle MANOPD-85447 - image upgrade issue
-if FORCED_UPGRADE:
-    import datetime
-    kube_helper = KubernetesHelper(None)
-    cr = kube_helper.get_custom_resource()
-    if cr:
-        cr["spec"]['mistral']['lastUpdate'] = datetime.datetime.now()
-        kube_helper.update_custom_resource(cr)
-
 
 @kopf.on.startup()
 def configure(settings: kopf.OperatorSettings, **_):
     settings.scanning.disabled = True
 
 
+@kopf.on.startup()
+def check_operator_upgrade(**_):
+    """Triggers the reconcile when another operator version reconciled the CR.
+
+    The version is recorded in the status by every reconcile, so restarts of
+    the same operator version do not touch the Mistral services.
+    """
+    kube_helper = KubernetesHelper(None)
+    try:
+        cr = kube_helper.get_custom_resource()
+    except ApiException as exc:
+        if exc.status != 404:
+            raise
+        logger.info("Custom resource is not created yet, skipping upgrade check")
+        return
+    reconciled_version = (cr.get('status') or {}).get('operatorVersion')
+    if reconciled_version == MC.OPERATOR_VERSION:
+        logger.info("Custom resource is reconciled by the running operator"
+                    " version, skipping upgrade reconcile")
+        return
+    logger.info("Operator version changed from %s to %s, triggering reconcile",
+                reconciled_version, MC.OPERATOR_VERSION)
+    kube_helper.update_custom_resource({
+        'spec': {
+            'mistral': {'lastUpdate': datetime.datetime.now().isoformat()}
+        }
+    })
+
+
 def validate_spec(spec):
     pass
 
 
 @kopf.on.create(MC.CR_GROUP, MC.CR_VERSION, MC.CR_PLURAL)
-def on_create(body, meta, spec, status, **kwargs):
-    kub_helper = KubernetesHelper(spec)
+async def on_create(body, meta, spec, status, **kwargs):
+    kub_helper = KubernetesHelper(
+        spec, KubernetesHelper.get_spec_revision(spec), status)
+    lane = get_switchover_lane()
     logger.info("New CRD is created")
     validate_spec(spec)
-    kub_helper.initiate_status()
-    # we do not need to create secret - it should be already present
-    if not kub_helper.is_secret_present(MC.MISTRAL_SECRET):
-        kub_helper.update_status(
-            MC.Status.FAILED,
-            "Error",
-            "Mistral secret should be present"
-        )
-        sleep(5)
-        raise kopf.PermanentError("please create Mistral secret.")
-    kub_helper.generate_idp_params()
-    kub_helper.update_mistral_common_configmap()
-    if kub_helper.is_mistral_lite():
-        kub_helper.delete_lite_deployment(MC.MISTRAL_LITE_DEPLOYMENT)
-        kub_helper.apply_lite_deployment_config(MC.MISTRAL_LITE_DEPLOYMENT)
-    else:
-        if kub_helper.should_cleanup():
-            kub_helper.cleanup_job()
-        kub_helper.create_rabbit_credentials()
-        if not kub_helper.check_if_rmq_exchange_durable():
-            kub_helper.scale_down_mistral_deployments()
-            kub_helper.delete_existing_queues()
-        kub_helper.update_db_job()
-        for service in MC.MISTRAL_SERVICES:
-            if kub_helper.is_deployment_present(service):
-                kub_helper.update_deployment(
-                    service,
-                    MC.SERVICES_NAME_TO_SERVER[service]
-                )
-            else:
-                kub_helper.apply_deployment_config(
-                    service,
-                    MC.SERVICES_NAME_TO_SERVER[service]
-                )
-    if not kub_helper.is_service_present(MC.MONITORING_SERVICE):
-        kub_helper.create_mistral_monitoring_service()
-    if not kub_helper.is_service_present(MC.MISTRAL_SERVICE):
-        kub_helper.create_mistral_service()
-    kub_helper.set_deploy_status_and_run_tests()
+    try:
+        await asyncio.to_thread(kub_helper.initiate_status)
+        # we do not need to create secret - it should be already present
+        if not await asyncio.to_thread(kub_helper.is_secret_present, MC.MISTRAL_SECRET):
+            await asyncio.to_thread(
+                kub_helper.update_status,
+                MC.Status.FAILED,
+                "Error",
+                "Mistral secret should be present"
+            )
+            raise kopf.PermanentError("please create Mistral secret.")
+        await asyncio.to_thread(kub_helper.generate_idp_params)
+        await kub_helper.run_step(MC.COMMON_CONFIGMAP, functools.partial(
+            asyncio.to_thread, kub_helper.update_mistral_common_configmap))
+        if kub_helper.is_mistral_lite():
+            await kub_helper.delete_lite_deployment(MC.MISTRAL_LITE_DEPLOYMENT)
+            await asyncio.to_thread(kub_helper.apply_lite_deployment_config,
+                                    MC.MISTRAL_LITE_DEPLOYMENT)
+        else:
+            if kub_helper.should_cleanup():
+                await kub_helper.run_step(MC.CLEANUP_JOB, kub_helper.cleanup_job)
+            await kub_helper.run_step(MC.RABBITMQ_RESOURCES, functools.partial(
+                asyncio.to_thread, kub_helper.create_rabbit_credentials))
+            if await asyncio.to_thread(
+                    kub_helper.is_step_completed, MC.PURGE_QUEUES_STEP) \
+                    or not await asyncio.to_thread(
+                        kub_helper.check_if_rmq_exchange_durable):
+                await lane.preemptible(functools.partial(
+                    kub_helper.run_step, MC.PURGE_QUEUES_STEP,
+                    kub_helper.purge_mistral_queues))
+            await lane.preemptible(kub_helper.rollout_mistral_deployments)
+        await kub_helper.run_step(MC.SERVICES_STEP, functools.partial(
+            asyncio.to_thread, apply_mistral_services, kub_helper))
+        await asyncio.to_thread(kub_helper.record_secret_hash, MC.MISTRAL_SECRET)
+        kub_helper.record_operator_version()
+        await asyncio.to_thread(kub_helper.update_apply_status)
+        await lane.preemptible(kub_helper.set_deploy_status_and_run_tests)
+    finally:
+        await asyncio.to_thread(kub_helper.flush_status)
+    logger.info("Object cache stats: %s", kub_helper.get_cache_stats())
+    logger.info("RabbitMQ management API stats: %s",
+                kub_helper.get_rabbitmq_stats())
+
+
+def apply_mistral_services(kub_helper):
+    kub_helper.apply_mistral_monitoring_service()
+    kub_helper.apply_mistral_service()
 
 
 def spec_filter_with_excluded_field(diff, excluded_field: str) -> bool:
@@ -136,77 +168,117 @@ def check_if_mistral_scale_down_needed(kube_helper, diff):
         return False
 
 
+def get_affected_resources(diff):
+    """Returns the resources influenced by the changed spec paths."""
+    resources = set()
+    for _, field, _, _ in diff:
+        if field[:1] != ('spec',):
+            continue
+        path = field[1:]
+        matches = [key for key in MC.SPEC_PATH_RESOURCES
+                   if path[:len(key)] == key]
+        if not matches:
+            return set(MC.RECONCILE_RESOURCES)
+        resources.update(MC.SPEC_PATH_RESOURCES[max(matches, key=len)])
+    return resources
+
+
 def exclude_disaster_recovery_field(spec, diff, **kwargs):
     return spec_filter_with_excluded_field(diff, 'disasterRecovery')
 
 
 @kopf.on.update(MC.CR_GROUP, MC.CR_VERSION, MC.CR_PLURAL, when=exclude_disaster_recovery_field)
-def on_update(body, meta, spec, status, old, new, diff, **kwargs):
+async def on_update(body, meta, spec, status, old, new, diff, **kwargs):
     if not check_for_operator_id(spec):
         logger.info("New Mistral operator deployment discovered, awaiting deployment"
                     " readiness is established.")
-        sleep(90)
-        return
+        raise kopf.TemporaryError(
+            "Custom resource is handled by another operator deployment.",
+            delay=MC.OPERATOR_ID_RETRY_DELAY)
 
     logger.info("changes: %s", str(diff))
     logger.info('Handling the diff')
-    kub_helper = KubernetesHelper(spec)
-    kub_helper.initiate_status()
-    if not kub_helper.is_secret_present(MC.MISTRAL_SECRET):
-        kub_helper.update_status(
-            MC.Status.FAILED,
-            "Error",
-            "Mistral secret should be present"
-        )
-        sleep(5)
-        raise kopf.PermanentError("please create Mistral secret.")
-    if kub_helper.integration_tests_enabled() and kub_helper.run_tests_only():
-        kub_helper.set_deploy_status_and_run_tests()
-        return
-    idp_updated = kub_helper.generate_idp_params()
-    if kub_helper.is_deployment_present(MC.MISTRAL_TESTS):
-        kub_helper.delete_deployment(MC.MISTRAL_TESTS, True)
-        sleep(5)
-    kub_helper.update_mistral_common_configmap()
-    if kub_helper.is_mistral_lite():
-        kub_helper.update_lite_deployment(MC.MISTRAL_LITE_DEPLOYMENT)
-    else:
-        kub_helper.create_rabbit_credentials()
-        if not kub_helper.check_if_rmq_exchange_durable() or idp_updated or \
-               check_if_mistral_scale_down_needed(kub_helper, diff):
-            kub_helper.scale_down_mistral_deployments()
-            kub_helper.delete_existing_queues()
-        kub_helper.update_db_job()
-        for service in MC.MISTRAL_SERVICES:
-            if kub_helper.is_deployment_present(service):
-                kub_helper.update_deployment(
-                    service,
-                    MC.SERVICES_NAME_TO_SERVER[service]
-                )
-            else:
-                kub_helper.apply_deployment_config(
-                    service,
-                    MC.SERVICES_NAME_TO_SERVER[service]
-                )
-
-    if not kub_helper.is_service_present(MC.MONITORING_SERVICE):
-        kub_helper.create_mistral_monitoring_service()
-    if not kub_helper.is_service_present(MC.MISTRAL_SERVICE):
-        kub_helper.create_mistral_service()
-    kub_helper.set_deploy_status_and_run_tests()
+    kub_helper = KubernetesHelper(
+        spec, KubernetesHelper.get_spec_revision(spec), status)
+    lane = get_switchover_lane()
+    try:
+        await asyncio.to_thread(kub_helper.initiate_status)
+        if not await asyncio.to_thread(kub_helper.is_secret_present, MC.MISTRAL_SECRET):
+            await asyncio.to_thread(
+                kub_helper.update_status,
+                MC.Status.FAILED,
+                "Error",
+                "Mistral secret should be present"
+            )
+            raise kopf.PermanentError("please create Mistral secret.")
+        if kub_helper.integration_tests_enabled() and kub_helper.run_tests_only():
+            await lane.preemptible(kub_helper.set_deploy_status_and_run_tests)
+            return
+        idp_updated = await asyncio.to_thread(kub_helper.generate_idp_params)
+        if await asyncio.to_thread(kub_helper.is_deployment_present, MC.MISTRAL_TESTS):
+            await asyncio.to_thread(kub_helper.delete_deployment, MC.MISTRAL_TESTS, True)
+            await kub_helper.wait_for_deletion('deployment', MC.MISTRAL_TESTS)
+        resources = get_affected_resources(diff)
+        logger.info("Resources affected by the update: %s", sorted(resources))
+        if MC.COMMON_CONFIGMAP in resources:
+            await kub_helper.run_step(MC.COMMON_CONFIGMAP, functools.partial(
+                asyncio.to_thread, kub_helper.update_mistral_common_configmap))
+        if kub_helper.is_mistral_lite():
+            await asyncio.to_thread(kub_helper.apply_lite_deployment_config,
+                                    MC.MISTRAL_LITE_DEPLOYMENT)
+        else:
+            rabbitmq_changed = MC.RABBITMQ_RESOURCES in resources
+            if rabbitmq_changed:
+                await kub_helper.run_step(MC.RABBITMQ_RESOURCES, functools.partial(
+                    asyncio.to_thread, kub_helper.create_rabbit_credentials))
+            # A completed purge still requires the scaled down services back
+            if await asyncio.to_thread(
+                    kub_helper.is_step_completed, MC.PURGE_QUEUES_STEP) \
+                    or (rabbitmq_changed and not await asyncio.to_thread(
+                        kub_helper.check_if_rmq_exchange_durable)) \
+                    or idp_updated or await asyncio.to_thread(
+                        check_if_mistral_scale_down_needed, kub_helper, diff):
+                await lane.preemptible(functools.partial(
+                    kub_helper.run_step, MC.PURGE_QUEUES_STEP,
+                    kub_helper.purge_mistral_queues))
+                resources.update(MC.MISTRAL_SERVICES)
+            await lane.preemptible(functools.partial(
+                kub_helper.rollout_mistral_deployments, resources))
+
+        await kub_helper.run_step(MC.SERVICES_STEP, functools.partial(
+            asyncio.to_thread, apply_mistral_services, kub_helper))
+        await asyncio.to_thread(kub_helper.record_secret_hash, MC.MISTRAL_SECRET)
+        kub_helper.record_operator_version()
+        await asyncio.to_thread(kub_helper.update_apply_status)
+        await lane.preemptible(kub_helper.set_deploy_status_and_run_tests)
+    finally:
+        await asyncio.to_thread(kub_helper.flush_status)
+    logger.info("Object cache stats: %s", kub_helper.get_cache_stats())
+    logger.info("RabbitMQ management API stats: %s",
+                kub_helper.get_rabbitmq_stats())
 
 
 @kopf.on.delete(MC.CR_GROUP, MC.CR_VERSION, MC.CR_PLURAL, optional=OPTIONAL_DELETE)
 @kopf.on.delete(MC.CR_GROUP, MC.CR_VERSION, MC.CR_PLURAL, optional=OPTIONAL_DELETE)
-def on_delete(spec, **kwargs):
+async def on_delete(spec, **kwargs):
     logger.info('Deleting Mistral')
     kub_helper = KubernetesHelper(spec)
+    await asyncio.to_thread(delete_mistral_resources, kub_helper)
+    if kub_helper.is_mistral_lite():
+        await kub_helper.delete_lite_deployment(MC.MISTRAL_LITE_DEPLOYMENT)
+
+
+def delete_mistral_resources(kub_helper):
     if kub_helper.is_secret_present(MC.MISTRAL_SECRET):
         kub_helper.delete_mistral_secret()
     if kub_helper.is_configmap_present(MC.COMMON_CONFIGMAP):
         kub_helper.delete_configmap(MC.COMMON_CONFIGMAP)
     if kub_helper.is_configmap_present(MC.CUSTOM_CONFIGMAP):
         kub_helper.delete_configmap(MC.CUSTOM_CONFIGMAP)
+    for job in MC.LOGGED_JOBS:
+        logs_configmap = kub_helper.get_job_logs_configmap(job)
+        if kub_helper.is_configmap_present(logs_configmap):
+            kub_helper.delete_configmap(logs_configmap)
     if kub_helper.is_db_update_job_present():
         kub_helper.delete_db_job()
     for service in MC.MISTRAL_SERVICES:
@@ -214,42 +286,141 @@ def on_delete(spec, **kwargs):
             kub_helper.delete_deployment(service)
     if kub_helper.is_service_present(MC.MISTRAL_SERVICE):
         kub_helper.delete_mistral_service()
-    if kub_helper.is_mistral_lite():
-        kub_helper.delete_lite_deployment(MC.MISTRAL_LITE_DEPLOYMENT)
 
 
-@kopf.on.field(MC.CR_GROUP, MC.CR_VERSION, MC.CR_PLURAL, field='spec.disasterRecovery.mode')
-def set_disaster_recovery_state(spec, status, namespace, diff, **kwargs):
-    mode = spec.get('disasterRecovery').get('mode', None)
-    if mode is None:
-        raise kopf.PermanentError("disaster recovery mode is not specified")
+@kopf.on.probe(id='switchover')
+def switchover_metrics(**_):
+    """Reports the switchover durations on the operator liveness endpoint."""
+    return get_switchover_metrics().snapshot()
+
+
+def get_requested_mode(cr, handled_mode):
+    """Returns the disaster recovery mode to switch to, None if nothing to do."""
+    if cr is None:
+        return None
+    mode = (cr['spec'].get('disasterRecovery') or {}).get('mode')
+    if mode is None or mode == handled_mode:
+        return None
+    if handled_mode is None:
+        # Right after the start the mode is compared with the status
+        dr_status = (cr.get('status') or {}).get('disasterRecoveryStatus') or {}
+        if dr_status.get('mode') == mode and dr_status.get('status') != 'running':
+            return None
+    return mode
+
+
+@kopf.daemon(MC.CR_GROUP, MC.CR_VERSION, MC.CR_PLURAL)
+async def disaster_recovery_lane(spec, stopped, **kwargs):
+    """Runs the switchovers without waiting for the running reconcile.
+
+    The mode changes are taken from the object cache, which follows the
+    custom resource independently of the kopf handlers.
+    """
+    kub_helper = KubernetesHelper(spec)
+    lane = get_switchover_lane()
+    handled_mode = None
+    while not stopped:
+        requested, cr = await kub_helper.wait_for_custom_resource(
+            lambda cr: get_requested_mode(cr, handled_mode) is not None,
+            MC.SWITCHOVER_CHECK_INTERVAL)
+        if not requested:
+            continue
+        mode = get_requested_mode(cr, handled_mode)
+        switchover = functools.partial(
+            set_disaster_recovery_state, cr['spec'], cr.get('status') or {})
+        if cr['spec']['disasterRecovery'].get('noWait', False):
+            # The progress is reported in the status while the lane watches
+            # for the next mode change
+            lane.start_switchover(switchover)
+        else:
+            await lane.switchover(switchover)
+        handled_mode = mode
+
+
+async def set_disaster_recovery_state(spec, status):
+    mode = spec['disasterRecovery']['mode']
     no_wait: bool = spec.get('disasterRecovery').get('noWait', False)
     status_mode = status.get('disasterRecoveryStatus', None)
     if status_mode is not None:
         status_mode = status_mode.get('mode', None)
     kub_helper = KubernetesHelper(spec)
-    kub_helper.update_disaster_recovery_status(
-        mode=mode,
-        status="running",
-        message="The switchover process for Mistral Service has been started")
+    metrics = get_switchover_metrics()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    start_time = kub_helper.get_timestamp()
+    steps = []
+
+    async def run_step(name, step):
+        # Every step is reported, so the progress is visible while it runs
+        entry = {'name': name, 'status': 'running',
+                 'startTime': kub_helper.get_timestamp()}
+        steps.append(entry)
+        await asyncio.to_thread(
+            kub_helper.update_disaster_recovery_status,
+            mode=mode, status="running",
+            message=f"The switchover step {name} is running", steps=steps)
+        step_started = loop.time()
+        try:
+            deployments = await step()
+        except Exception:
+            entry['status'] = 'failed'
+            raise
+        else:
+            entry['status'] = 'done'
+            # The scale steps return the seconds every deployment took
+            if deployments:
+                entry['deployments'] = deployments
+                for deployment, seconds in deployments.items():
+                    if seconds is not None:
+                        metrics.observe(f"{name}/{deployment}", seconds)
+        finally:
+            entry['endTime'] = kub_helper.get_timestamp()
+            entry['durationSeconds'] = round(loop.time() - step_started, 3)
+            metrics.observe(name, entry['durationSeconds'])
 
-    status = "done"
-    message = "success installation"
     try:
-        logger.info(f"Start switchover with mode: {mode} and no-wait: {no_wait},"
-                    f" current status mode is: {status_mode}")
-        if mode == 'standby' or mode == 'disable':
-            kub_helper.scale_down_mistral_deployments()
-
-        if mode == 'active':
-            if status_mode is not None:
-                kub_helper.mistral_dr_job()
-                kub_helper.scale_up_mistral_deployments()
-
-    except Exception as e:
-        status = "failed"
-        message = e.__str__()
-        logger.error(f"Switchover failed: {message}")
-    kub_helper.update_disaster_recovery_status(mode=mode, status=status,
-                                               message=message)
-    logger.info("Switchover finished successfully")
+        await asyncio.to_thread(
+            kub_helper.update_disaster_recovery_status,
+            mode=mode,
+            status="running",
+            message="The switchover process for Mistral Service has been started",
+            steps=steps)
+
+        status = "done"
+        message = "success installation"
+        try:
+            logger.info(f"Start switchover with mode: {mode} and no-wait: {no_wait},"
+                        f" current status mode is: {status_mode}")
+            if mode == 'standby' or mode == 'disable':
+                await run_step('scale-down', kub_helper.scale_down_mistral_deployments)
+
+            if mode == 'active':
+                if status_mode is not None:
+                    await run_step('dr-job', kub_helper.mistral_dr_job)
+                    await run_step('scale-up', kub_helper.scale_up_mistral_deployments)
+
+        except Exception as e:
+            status = "failed"
+            message = e.__str__()
+            logger.error(f"Switchover failed: {message}")
+        duration = round(loop.time() - started, 3)
+        metrics.observe(f"switchover/{mode}", duration)
+        metrics.count_result(mode, status)
+        timings = {
+            'durationSeconds': duration,
+            'phases': {entry['name']: entry['durationSeconds'] for entry in steps},
+        }
+        await asyncio.to_thread(kub_helper.record_switchover, {
+            'mode': mode,
+            'status': status,
+            'startTime': start_time,
+            **timings,
+        })
+        await asyncio.to_thread(kub_helper.update_disaster_recovery_status,
+                                mode=mode, status=status, message=message,
+                                steps=steps, timings=timings)
+        logger.info("Switchover finished with status %s in %s seconds: %s",
+                    status, duration, timings['phases'])
+    finally:
+        # Conditions added by the failed steps are written as well
+        await asyncio.to_thread(kub_helper.flush_status)
@@ -0,0 +1,136 @@
+"""
+Module with the client of the IDP used to generate the auth parameters
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import mistral_constants as MC
+
+logger = logging.getLogger(__name__)
+
+KEYCLOAK_JWK_PATH = "/auth/realms/cloud-common/protocol/openid-connect/certs"
+JWK_PATH = "/jwk"
+
+
+class IdpClient:
+    """Keeps one session to the IDP and caches its answers.
+
+    The JWK is cached for the max-age the IDP returns, MC.IDP_JWK_TTL by
+    default, and revalidated with its ETag afterwards. The last registered
+    client is cached per client name together with the registration token
+    and the revision of the secret it is stored in, so a retried reconcile
+    does not register the client again, but a cleared or changed secret
+    does.
+    """
+
+    def __init__(self, server):
+        self._server = server
+        self._session = self._create_session()
+        self._lock = threading.Lock()
+        self._jwks = {}
+        self._clients = {}
+
+    @staticmethod
+    def _create_session():
+        # The registration is not idempotent, only GETs are retried
+        retries = Retry(
+            total=MC.IDP_REQUEST_RETRIES,
+            backoff_factor=MC.IDP_RETRY_BACKOFF,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2,
+                              max_retries=retries)
+        session = requests.Session()
+        session.verify = MC.IDP_CERT_FILE_PATH
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _request(self, method, path, **kwargs):
+        return self._session.request(
+            method, self._server + path,
+            timeout=(MC.IDP_CONNECT_TIMEOUT, MC.IDP_READ_TIMEOUT),
+            **kwargs)
+
+    @staticmethod
+    def _max_age(response):
+        match = re.search(r'max-age=(\d+)',
+                          response.headers.get('Cache-Control', ''))
+        return int(match.group(1)) if match else MC.IDP_JWK_TTL
+
+    def get_jwk(self, auth_type):
+        """Returns the exponent and the modulus of the first IDP key."""
+        path = KEYCLOAK_JWK_PATH if auth_type == "keycloak-oidc" else JWK_PATH
+        with self._lock:
+            cached = self._jwks.get(path)
+        if cached and cached['expires'] > time.monotonic():
+            return cached['jwk']
+
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        res = self._request('GET', path, headers=headers)
+        if res.status_code == 304 and cached:
+            logger.debug("JWK of %s is not modified", self._server)
+            jwk = cached['jwk']
+        else:
+            res.raise_for_status()
+            key = res.json()['keys'][0]
+            jwk = key['e'], key['n']
+        with self._lock:
+            self._jwks[path] = {
+                'jwk': jwk,
+                'etag': res.headers.get('ETag')
+                or (cached['etag'] if cached else None),
+                'expires': time.monotonic() + self._max_age(res),
+            }
+        return jwk
+
+    def register_client(self, registration_token, client_name,
+                        revision=None):
+        """Registers the client and returns its ID and secret.
+
+        :param revision: hash of the secret the credentials are stored in.
+        """
+        key = hashlib.sha256(
+            registration_token.encode('utf-8')).hexdigest(), revision
+        with self._lock:
+            cached = self._clients.get(client_name)
+            if cached and cached[0] == key:
+                return cached[1]
+        res = self._request(
+            'POST', "/register",
+            headers={"Authorization": "Bearer " + registration_token},
+            json={
+                "client_name": client_name,
+                "grant_types": ["client_credentials", "redelegate"],
+                "scope": "profile"
+            }
+        )
+        res.raise_for_status()
+        body = res.json()
+        credentials = body['client_id'], body['client_secret']
+        with self._lock:
+            self._clients[client_name] = key, credentials
+        return credentials
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_idp_client(server):
+    with _clients_lock:
+        idp_client = _clients.get(server)
+        if idp_client is None:
+            idp_client = IdpClient(server)
+            _clients[server] = idp_client
+        return idp_client
@@ -0,0 +1,320 @@
+"""
+Module with the watch-fed cache of the namespaced kubernetes objects
+"""
+import asyncio
+import functools
+import logging
+import threading
+from time import sleep
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+import mistral_constants as MC
+from kubernetes_client import get_kubernetes_apis
+from retry_policy import get_retry_policy
+
+logger = logging.getLogger(__name__)
+
+
+def _name(obj):
+    # Custom objects are listed and watched as plain dicts
+    if isinstance(obj, dict):
+        return obj['metadata']['name']
+    return obj.metadata.name
+
+
+def _version(obj):
+    """Returns the resource version of the object as a number, if it is one."""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        version = obj['metadata'].get('resourceVersion')
+    else:
+        version = obj.metadata.resource_version
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        return None
+
+
+def _page(result):
+    """Returns the items, the continue token and the version of a list."""
+    if isinstance(result, dict):
+        metadata = result['metadata']
+        return (result['items'], metadata.get('continue'),
+                metadata['resourceVersion'])
+    return (result.items, result.metadata._continue,
+            result.metadata.resource_version)
+
+
+class _Informer:
+    """Keeps the objects of one kind in sync with the API server.
+
+    The informer lists the objects once and then follows the watch stream
+    from the listed resource version. The stream is relisted only when the
+    API server reports the resource version as expired.
+
+    ``dirty`` maps the objects written by the operator to the resource
+    version of the write, None when the write did not return one. The mark
+    is cleared by the first watch event at or after that version.
+    """
+
+    def __init__(self, kind, list_func, namespace, lock, notify,
+                 label_selector=None, metadata_only=False):
+        self.kind = kind
+        self.objects = {}
+        self.dirty = {}
+        self.synced = False
+        self.metadata_only = metadata_only
+        self._list_func = list_func
+        self._namespace = namespace
+        self._list_kwargs = {'label_selector': label_selector} \
+            if label_selector else {}
+        self._lock = lock
+        self._notify = notify
+        self._retry_policy = get_retry_policy('watch')
+        self._thread = threading.Thread(
+            target=self._run, name=f"informer-{kind}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        delays = self._retry_policy.delays()
+        while True:
+            try:
+                resource_version = self._list()
+                delays = self._retry_policy.delays()
+                self._watch(resource_version)
+            except ApiException as exc:
+                if exc.status != 410:
+                    logger.warning("Watch of %s objects failed: %s",
+                                   self.kind, exc)
+            except Exception:
+                logger.exception("Watch of %s objects failed", self.kind)
+            with self._lock:
+                self.synced = False
+            sleep(next(delays))
+
+    def _list(self):
+        objects = {}
+        continue_token = None
+        while True:
+            items = self._list_func(namespace=self._namespace,
+                                    limit=MC.CACHE_LIST_PAGE_SIZE,
+                                    _continue=continue_token,
+                                    **self._list_kwargs)
+            items, continue_token, resource_version = _page(items)
+            objects.update((_name(obj), obj) for obj in items)
+            if not continue_token:
+                break
+        with self._lock:
+            self.objects = objects
+            self.dirty.clear()
+            self.synced = True
+            self._notify()
+        logger.debug("Listed %d %s objects", len(objects), self.kind)
+        return resource_version
+
+    def _watch(self, resource_version):
+        stream = watch.Watch()
+        while True:
+            for event in stream.stream(
+                    self._list_func,
+                    namespace=self._namespace,
+                    resource_version=resource_version,
+                    timeout_seconds=MC.CACHE_WATCH_TIMEOUT,
+                    **self._list_kwargs):
+                obj = event['object']
+                name = _name(obj)
+                version = _version(obj)
+                with self._lock:
+                    if event['type'] == 'DELETED':
+                        self.objects.pop(name, None)
+                    else:
+                        self.objects[name] = obj
+                    if name in self.dirty:
+                        written = self.dirty[name]
+                        if written is None or version is None \
+                                or version >= written:
+                            del self.dirty[name]
+                    self._notify()
+                if version is not None:
+                    resource_version = str(version)
+
+
+class ObjectCache:
+    """Namespace scoped in-memory view of the objects the operator manages.
+
+    Lookups are answered from the watch-fed informers. A lookup is counted
+    as a miss and has to be answered by the API server when the informer is
+    not synced yet, or when the object was written by the operator and the
+    watch event for that write has not arrived yet.
+
+    Secrets and config maps are watched by their metadata only, so the
+    cache knows which of them exist but their payloads are read from the
+    API server.
+    """
+
+    def __init__(self, namespace):
+        self._namespace = namespace
+        self._lock = threading.Lock()
+        apis = get_kubernetes_apis()
+        self._api_client = apis.api_client
+        list_funcs = {
+            'deployment': apis.apps_api.list_namespaced_deployment,
+            'secret': apis.metadata_list_func('secret'),
+            'configmap': apis.metadata_list_func('configmap'),
+            'service': apis.core_api.list_namespaced_service,
+            'job': apis.batch_api.list_namespaced_job,
+            MC.CR_KIND: functools.partial(
+                apis.custom_objects_api.list_namespaced_custom_object,
+                MC.CR_GROUP, MC.CR_VERSION, plural=MC.CR_PLURAL),
+        }
+        label_selectors = {
+            'deployment': MC.DEPLOYMENTS_LABEL_SELECTOR,
+        }
+        metadata_only = {'secret', 'configmap'}
+        self._informers = {
+            kind: _Informer(kind, list_func, namespace, self._lock,
+                            self._notify, label_selectors.get(kind),
+                            kind in metadata_only)
+            for kind, list_func in list_funcs.items()
+        }
+        self._waiters = set()
+        self._hits = dict.fromkeys(self._informers, 0)
+        self._misses = dict.fromkeys(self._informers, 0)
+
+    def _notify(self):
+        # Called by the informers with the lock held.
+        for loop, event in self._waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def start(self):
+        for informer in self._informers.values():
+            informer.start()
+
+    def contains(self, kind, name):
+        """Returns whether the object is present, None if it is unknown."""
+        informer = self._informers[kind]
+        with self._lock:
+            if not informer.synced or name in informer.dirty:
+                self._misses[kind] += 1
+                return None
+            self._hits[kind] += 1
+            return name in informer.objects
+
+    def get(self, kind, name):
+        """Returns whether the object is known and the cached object.
+
+        An existing object of a metadata-only kind is not known, its
+        payload has to be read from the API server.
+        """
+        informer = self._informers[kind]
+        with self._lock:
+            if not informer.synced or name in informer.dirty or (
+                    informer.metadata_only and name in informer.objects):
+                self._misses[kind] += 1
+                return False, None
+            self._hits[kind] += 1
+            return True, informer.objects.get(name)
+
+    def get_metadata(self, kind, name):
+        """Returns the metadata of the object as a dict, None if unknown.
+
+        The metadata of an absent object is None as well.
+        """
+        informer = self._informers[kind]
+        with self._lock:
+            if not informer.synced or name in informer.dirty:
+                self._misses[kind] += 1
+                return None
+            self._hits[kind] += 1
+            obj = informer.objects.get(name)
+        if obj is None:
+            return None
+        if isinstance(obj, dict):
+            return obj['metadata']
+        return self._api_client.sanitize_for_serialization(obj.metadata)
+
+    def get_annotations(self, kind, name):
+        """Returns the annotations of the object, None if it is unknown."""
+        metadata = self.get_metadata(kind, name)
+        if metadata is None:
+            return None
+        return metadata.get('annotations') or {}
+
+    async def wait_for(self, kind, name, predicate, timeout):
+        """Waits until the predicate is true for the cached object.
+
+        The predicate gets None while the object is absent. Returns whether
+        the predicate was satisfied before the timeout and the last object
+        seen. The waiter is woken up by the informer threads, so no thread
+        is held while waiting.
+        """
+        informer = self._informers[kind]
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        waiter = (loop, asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                with self._lock:
+                    obj = informer.objects.get(name)
+                    satisfied = informer.synced \
+                        and name not in informer.dirty and predicate(obj)
+                if satisfied:
+                    return True, obj
+                remaining = None if deadline is None \
+                    else deadline - loop.time()
+                if remaining is not None and remaining <= 0:
+                    return False, obj
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def invalidate(self, kind, name, written=None):
+        """Marks the object as changed by the operator itself.
+
+        :param written: the object returned by the write. The mark is not
+            set when the cache already holds its resource version, a write
+            which changed nothing is not followed by a watch event.
+        """
+        version = _version(written)
+        informer = self._informers[kind]
+        with self._lock:
+            cached = _version(informer.objects.get(name))
+            if version is not None and cached is not None \
+                    and cached >= version:
+                informer.dirty.pop(name, None)
+            else:
+                informer.dirty[name] = version
+
+    def stats(self):
+        with self._lock:
+            return {
+                kind: {'hits': self._hits[kind],
+                       'misses': self._misses[kind]}
+                for kind in self._informers
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_object_cache(namespace):
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            cache = ObjectCache(namespace)
+            cache.start()
+            _caches[namespace] = cache
+        return cache
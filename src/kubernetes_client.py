@@ -0,0 +1,155 @@
+"""
+Module with the kubernetes API client shared by the whole operator process
+"""
+import logging
+import threading
+
+from kubernetes import client
+
+import mistral_constants as MC
+
+logger = logging.getLogger(__name__)
+
+SA_NAMESPACE_PATH = '/var/run/secrets/kubernetes.io/' \
+                    'serviceaccount/namespace'
+PARTIAL_METADATA_LIST = 'application/json;as=PartialObjectMetadataList;' \
+                        'g=meta.k8s.io;v=v1'
+PARTIAL_METADATA = 'application/json;as=PartialObjectMetadata;' \
+                   'g=meta.k8s.io;v=v1'
+RESOURCE_PATHS = {
+    'deployment': '/apis/apps/v1/namespaces/{namespace}/deployments',
+    'secret': '/api/v1/namespaces/{namespace}/secrets',
+    'configmap': '/api/v1/namespaces/{namespace}/configmaps',
+    'service': '/api/v1/namespaces/{namespace}/services',
+    'job': '/apis/batch/v1/namespaces/{namespace}/jobs',
+}
+RESOURCE_MODELS = {
+    'deployment': 'V1Deployment',
+    'secret': 'V1Secret',
+    'configmap': 'V1ConfigMap',
+    'service': 'V1Service',
+    'job': 'V1Job',
+}
+APPLY_PATCH = 'application/apply-patch+yaml'
+JSON_PATCH = 'application/json-patch+json'
+
+
+class KubernetesApis:
+    """API wrappers over one pooled ApiClient.
+
+    The urllib3 pool of the client keeps the connections to the API server
+    alive between requests, so handlers, informers and background tasks
+    reuse them instead of setting up TLS for every helper.
+    """
+
+    def __init__(self):
+        configuration = client.Configuration.get_default_copy()
+        configuration.connection_pool_maxsize = MC.KUBE_CONNECTION_POOL_SIZE
+        self.api_client = client.ApiClient(configuration)
+        self.apps_api = client.AppsV1Api(self.api_client)
+        self.core_api = client.CoreV1Api(self.api_client)
+        self.batch_api = client.BatchV1Api(self.api_client)
+        self.custom_objects_api = client.CustomObjectsApi(self.api_client)
+        with open(SA_NAMESPACE_PATH, encoding='utf-8') as file:
+            self.namespace = file.read()
+        logger.info("Kubernetes API client is created with a pool of %d"
+                    " connections", MC.KUBE_CONNECTION_POOL_SIZE)
+
+    def list_metadata(self, kind, namespace, **params):
+        """Lists only the metadata of the objects.
+
+        The API server answers with a PartialObjectMetadataList, so neither
+        the payloads of the objects are transferred nor the models built.
+        Returns the list as a dict.
+        """
+        return self.api_client.call_api(
+            RESOURCE_PATHS[kind].format(namespace=namespace), 'GET',
+            query_params=[(key, value) for key, value in params.items()
+                          if value is not None],
+            header_params={'Accept': PARTIAL_METADATA_LIST},
+            response_type='object',
+            auth_settings=['BearerToken'],
+            _return_http_data_only=True)
+
+    def metadata_list_func(self, kind):
+        """Returns a list function of the metadata of the objects.
+
+        The function takes the arguments of the typed list methods, so the
+        informers can page and watch it the same way. Objects are returned
+        as dicts.
+        """
+        def list_func(namespace, label_selector=None, limit=None,
+                      _continue=None, resource_version=None,
+                      timeout_seconds=None, watch=None,
+                      _preload_content=True):
+            params = {
+                'labelSelector': label_selector,
+                'limit': limit,
+                'continue': _continue,
+                'resourceVersion': resource_version,
+                'timeoutSeconds': timeout_seconds,
+                'watch': str(watch).lower() if watch else None,
+            }
+            return self.api_client.call_api(
+                RESOURCE_PATHS[kind].format(namespace=namespace), 'GET',
+                query_params=[(key, value) for key, value in params.items()
+                              if value is not None],
+                # Watch events carry single objects
+                header_params={'Accept': PARTIAL_METADATA if watch
+                               else PARTIAL_METADATA_LIST},
+                response_type='object',
+                auth_settings=['BearerToken'],
+                _return_http_data_only=True,
+                _preload_content=_preload_content)
+        return list_func
+
+    def replace_managed_fields(self, kind, namespace, name, resource_version,
+                               managed_fields):
+        """Replaces the managed fields unless the object changed meanwhile."""
+        path = RESOURCE_PATHS[kind].format(namespace=namespace)
+        return self.api_client.call_api(
+            f'{path}/{name}', 'PATCH',
+            header_params={'Content-Type': JSON_PATCH,
+                           'Accept': 'application/json'},
+            body=[
+                {'op': 'test', 'path': '/metadata/resourceVersion',
+                 'value': resource_version},
+                {'op': 'replace', 'path': '/metadata/managedFields',
+                 'value': managed_fields},
+            ],
+            response_type=RESOURCE_MODELS[kind],
+            auth_settings=['BearerToken'],
+            _return_http_data_only=True)
+
+    def apply(self, kind, namespace, name, manifest, field_manager,
+              force=True):
+        """Server-side applies the manifest.
+
+        The typed patch methods of the older clients do not accept the
+        apply patch content type, so the request is sent with an explicit
+        header. Returns the applied object and the HTTP status.
+        """
+        path = RESOURCE_PATHS[kind].format(namespace=namespace)
+        obj, status, _ = self.api_client.call_api(
+            f'{path}/{name}', 'PATCH',
+            query_params=[('fieldManager', field_manager),
+                          ('force', str(force).lower())],
+            header_params={'Content-Type': APPLY_PATCH,
+                           'Accept': 'application/json'},
+            body=manifest,
+            response_type=RESOURCE_MODELS[kind],
+            auth_settings=['BearerToken'],
+            _return_http_data_only=False)
+        return obj, status
+
+
+_apis = None
+_apis_lock = threading.Lock()
+
+
+def get_kubernetes_apis():
+    global _apis
+    with _apis_lock:
+        if _apis is None:
+            _apis = KubernetesApis()
+        return _apis
@@ -1,17 +1,21 @@
 """
 Module to handle all the kubernetes operations
 """
-from time import sleep
 from datetime import datetime
 from datetime import timezone
 
+import asyncio
+import functools
+import hashlib
+import json
 import logging
 import base64
+import copy
+import threading
 import kopf
 import random
 import re
 import requests
-from threading import Thread
 
 from kubernetes import client
 from kubernetes.client import V1ObjectMeta, V1EnvVar, V1Container, V1PodSpec, \
@@ -21,11 +25,19 @@ from kubernetes.client import V1ObjectMeta, V1EnvVar, V1Container, V1PodSpec, \
     V1Volume, V1ConfigMapVolumeSource, V1KeyToPath, V1ConfigMap, \
     V1Service, V1ServiceSpec, V1ServicePort, V1ConfigMapKeySelector, \
     V1ResourceFieldSelector, V1LabelSelector, V1Job, V1JobSpec, \
-    V1DeleteOptions, V1ComponentCondition, V1ComponentStatus, V1SecurityContext, \
+    V1DeleteOptions, V1SecurityContext, \
     V1Capabilities, V1SeccompProfile, V1SecretVolumeSource
 
 import mistral_constants as MC
+from kubernetes_cache import get_object_cache
+from idp_client import get_idp_client
+from kubernetes_client import get_kubernetes_apis
 from rabbitmq_helper import RabbitMQHelper
+from reconcile_scheduler import run_steps
+from reconcile_snapshot import ReconcileSnapshot
+from retry_policy import get_retry_policy
+from status_writer import StatusWriter
+from switchover_lane import get_switchover_lane
 
 logging.basicConfig(
     filename='/proc/1/fd/1',
@@ -45,19 +57,43 @@ class FakeKubeResponse:
 
 
 class KubernetesHelper:
-    SA_NAMESPACE_PATH = '/var/run/secrets/kubernetes.io/' \
-                        'serviceaccount/namespace'
-
-    def __init__(self, spec):
-        self._api_client = client.ApiClient()
-        with open(self.SA_NAMESPACE_PATH, encoding='utf-8') as file:
-            self._workspace = file.read()
-        self._apps_api = client.AppsV1Api(self._api_client)
-        self._v1_apps_api = client.CoreV1Api(self._api_client)
-        self._batch_v1_api = client.BatchV1Api(self._api_client)
+    # Keeps the fire-and-forget tasks referenced until they are done.
+    _background_tasks = set()
+    MANIFEST_KINDS = {
+        'deployment': ('apps/v1', 'Deployment'),
+        'configmap': ('v1', 'ConfigMap'),
+        'service': ('v1', 'Service'),
+        'job': ('batch/v1', 'Job'),
+    }
+
+    def __init__(self, spec, revision=None, status=None):
+        apis = get_kubernetes_apis()
+        self._apis = apis
+        self._api_client = apis.api_client
+        self._workspace = apis.namespace
+        self._apps_api = apis.apps_api
+        self._v1_apps_api = apis.core_api
+        self._batch_v1_api = apis.batch_api
         self._spec = spec
-        self._custom_objects_api = client.CustomObjectsApi(self._api_client)
-        self.spec_hash = ''
+        self._revision = revision
+        self._cr_status = status or {}
+        self._steps_lock = threading.Lock()
+        self._custom_objects_api = apis.custom_objects_api
+        self._status_writer = StatusWriter(self._custom_objects_api,
+                                           self._workspace)
+        self._cache = get_object_cache(self._workspace)
+        self._read_funcs = {
+            'deployment': self._apps_api.read_namespaced_deployment,
+            'configmap': self._v1_apps_api.read_namespaced_config_map,
+            'service': self._v1_apps_api.read_namespaced_service,
+            'job': self._batch_v1_api.read_namespaced_job,
+            'secret': self._v1_apps_api.read_namespaced_secret,
+        }
+        self._snapshot = ReconcileSnapshot(self._cache, self._read_funcs,
+                                           self._workspace)
+        self._rmq_helper = None
+        self.apply_stats = dict.fromkeys(['created', 'updated', 'unchanged'], 0)
+        self._apply_stats_lock = threading.Lock()
         logger.info("configuration is: %s", str(spec))
 
     def get_container_security_context(self):
@@ -85,26 +121,82 @@ class KubernetesHelper:
 
         return client.V1PodSecurityContext(**sec_context)
 
-    def apply_deployment_config(self, name, server_name):
-        dcbody = self.generate_deployment_config_body(name, server_name)
-        kopf.adopt(dcbody)
-        self._apps_api.create_namespaced_deployment(self._workspace, dcbody)
-
     def apply_lite_deployment_config(self, name):
         dcbody = self.generate_lite_deployment_config_body(name)
-        kopf.adopt(dcbody)
-        self._apps_api.create_namespaced_deployment(self._workspace, dcbody)
+        self.apply_object('deployment', dcbody)
 
-    def get_job_status(self, job_name):
+    @staticmethod
+    def job_status(job_doc):
         job_status = None
-        job_doc = self._batch_v1_api.read_namespaced_job(
-            name=job_name, namespace=self._workspace
-        )
         if job_doc.status.succeeded == 1:
             job_status = MC.Status.SUCCESSFUL
         if job_doc.status.failed == 3:
             job_status = MC.Status.FAILED
-        return job_status, job_doc
+        for condition in job_doc.status.conditions or []:
+            if condition.type == 'Failed' and condition.status == 'True':
+                job_status = MC.Status.FAILED
+        return job_status
+
+    def get_job_status(self, job_name):
+        job_doc = self._batch_v1_api.read_namespaced_job(
+            name=job_name, namespace=self._workspace
+        )
+        return self.job_status(job_doc), job_doc
+
+    async def wait_for_job_completion(self, job_name):
+        logger.info("Waiting until %s job is completed", job_name)
+        completed, job_doc = await self._cache.wait_for(
+            'job', job_name,
+            lambda job: job is not None and self.job_status(job) is not None,
+            self.retry_policy('job').deadline
+        )
+        if not completed:
+            return await asyncio.to_thread(self.get_job_status, job_name)
+        return self.job_status(job_doc), job_doc
+
+    async def wait_for_deletion(self, kind, name):
+        logger.info("Waiting until old %s %s is deleted", kind, name)
+        policy = self.retry_policy('deletion')
+        deleted, _ = await self._cache.wait_for(
+            kind, name, lambda obj: obj is None, policy.deadline)
+        if not deleted:
+            raise kopf.TemporaryError(
+                f"Old {kind} {name} was not deleted"
+                f" in {policy.deadline:g} seconds.",
+                delay=policy.max_delay)
+
+    def delete_job(self, name):
+        delopt = V1DeleteOptions(propagation_policy='Background',
+                                 grace_period_seconds=0)
+        with get_switchover_lane().write_guard():
+            self._batch_v1_api.delete_namespaced_job(
+                namespace=self._workspace,
+                name=name,
+                body=delopt
+            )
+        self.invalidate('job', name)
+
+    async def recreate_job(self, jobbody):
+        """Starts the job unless an identical one is still running.
+
+        A finished or outdated job with the same name is deleted first.
+        """
+        name = jobbody.metadata.name
+        spec_hash = await asyncio.to_thread(self.prepare_object, jobbody)
+        live = await asyncio.to_thread(self.get_live_object, 'job', name)
+        if live is not None:
+            if self.is_up_to_date(live, live.metadata.annotations or {},
+                                   jobbody, spec_hash) \
+                    and self.job_status(live) is None:
+                logger.info("Identical %s job is still running, waiting for it",
+                            name)
+                self.count_apply('unchanged')
+                return
+            logger.info("Deleting old %s job", name)
+            await asyncio.to_thread(self.delete_job, name)
+            await self.wait_for_deletion('job', name)
+        await asyncio.to_thread(self.apply_manifest, 'job', jobbody)
+        self.count_apply('created')
 
     def get_job_logs(self, job_doc):
         job_logs = ""
@@ -129,31 +221,42 @@ class KubernetesHelper:
             job_logs += f"Exception when calling CoreV1Api->read_namespaced_pod_log: {exc}"
         return job_logs
 
-    def apply_update_db_job(self):
-        attempts = 36
-        sleep_between_iterations = 20
-        jobbody = self.generate_update_db_job_body()
-        kopf.adopt(jobbody)
-        self._batch_v1_api.create_namespaced_job(self._workspace, jobbody)
-        while attempts > 0:
-            sleep(sleep_between_iterations)
-            update_db_job_status, update_db_job_doc = self.get_job_status(job_name=MC.UPDATE_DB_JOB)
-            if update_db_job_status:
-                break
-            attempts = attempts - 1
-        if attempts == 0 or update_db_job_status == MC.Status.FAILED:
-            job_logs = self.get_job_logs(job_doc=update_db_job_doc)
+    @staticmethod
+    def get_job_logs_configmap(job_name):
+        return f"{job_name}-logs"
+
+    def store_job_logs(self, job_name, job_logs):
+        """Keeps the tail of the job logs in a config map, returns its name."""
+        name = self.get_job_logs_configmap(job_name)
+        configmap = V1ConfigMap(
+            metadata=V1ObjectMeta(name=name,
+                                  labels=self.get_labels({'app': job_name})),
+            data={'logs': job_logs[-MC.JOB_LOGS_LIMIT:]})
+        self.prepare_object(configmap)
+        self.apply_manifest('configmap', configmap)
+        return name
+
+    async def apply_update_db_job(self):
+        jobbody = await asyncio.to_thread(self.generate_update_db_job_body)
+        await self.recreate_job(jobbody)
+        update_db_job_status, update_db_job_doc = \
+            await self.wait_for_job_completion(MC.UPDATE_DB_JOB)
+        if update_db_job_status != MC.Status.SUCCESSFUL:
+            job_logs = await asyncio.to_thread(
+                self.get_job_logs, job_doc=update_db_job_doc)
             logger.error(
                 "Error with Mistral update db job. Following are failure logs"
                 " from Mistral update db job %s", job_logs
             )
-            self.update_status(
+            logs_configmap = await asyncio.to_thread(
+                self.store_job_logs, MC.UPDATE_DB_JOB, job_logs)
+            await asyncio.to_thread(
+                self.update_status,
                 MC.Status.FAILED,
                 "Error",
-                "Error with Mistral update db job. Following are failure logs"
-                " from Mistral update db job %s" % job_logs
+                "Error with Mistral update db job. Failure logs are stored"
+                f" in the {logs_configmap} config map."
             )
-            sleep(5)
             raise kopf.PermanentError("Error with Mistral update db job.")
 
     def generate_update_db_job_body(self):
@@ -530,59 +633,35 @@ class KubernetesHelper:
         )
         return job_template
 
-    def apply_mistral_dr_job(self):
-        attempts = 36
-        sleep_between_iterations = 20
-        jobbody = self.generate_mistral_dr_job_body()
-        kopf.adopt(jobbody)
-        self._batch_v1_api.create_namespaced_job(self._workspace, jobbody)
-        while attempts > 0:
-            mistral_dr_job_status, mistral_dr_job_doc = self.get_job_status(
-                job_name=MC.MISTRAL_DR_JOB
-            )
-            if mistral_dr_job_status:
-                break
-            attempts = attempts - 1
-            sleep(sleep_between_iterations)
-        if attempts == 0 or mistral_dr_job_status == MC.Status.FAILED:
-            job_logs = self.get_job_logs(mistral_dr_job_doc)
+    async def apply_mistral_dr_job(self):
+        jobbody = await asyncio.to_thread(self.generate_mistral_dr_job_body)
+        await self.recreate_job(jobbody)
+        mistral_dr_job_status, mistral_dr_job_doc = \
+            await self.wait_for_job_completion(MC.MISTRAL_DR_JOB)
+        if mistral_dr_job_status != MC.Status.SUCCESSFUL:
+            job_logs = await asyncio.to_thread(
+                self.get_job_logs, mistral_dr_job_doc)
             logger.info("Error with Mistral DR job. logs: \n %s", job_logs)
-            self.update_status(
+            logs_configmap = await asyncio.to_thread(
+                self.store_job_logs, MC.MISTRAL_DR_JOB, job_logs)
+            await asyncio.to_thread(
+                self.update_status,
                 MC.Status.FAILED,
                 "Error",
-                f"Error with Mistral DR job. logs: \n {job_logs}"
+                "Error with Mistral DR job. Failure logs are stored"
+                f" in the {logs_configmap} config map."
             )
-            sleep(5)
             raise kopf.PermanentError("Error with Mistral DR job.")
 
-    def is_mistral_dr_job_present(self):
-        jobs = self._batch_v1_api.list_namespaced_job(
-            namespace=self._workspace)
-        exists = list(
-            filter(lambda x: x.metadata.name == MC.MISTRAL_DR_JOB,
-                   jobs.items))
-        return len(exists) != 0
-
-    def mistral_dr_job(self):
-        delopt = V1DeleteOptions(propagation_policy='Background',
-                                 grace_period_seconds=0)
-        if self.is_mistral_dr_job_present():
-            logger.info("Deleting old Mistral DR job")
-            self._batch_v1_api.delete_namespaced_job(
-                namespace=self._workspace,
-                name=MC.MISTRAL_DR_JOB,
-                body=delopt
-            )
-        while self.is_mistral_dr_job_present():
-            logger.info("Waiting until old Mistral DR job deleted")
-            sleep(3)
-        self.apply_mistral_dr_job()
+    async def mistral_dr_job(self):
+        await self.apply_mistral_dr_job()
 
     def generate_deployment_config_body(self, name, server_name):
         livenessprobe = MC.LIVENESS_PROBE
         readinessprobe = MC.READINESS_PROBE
         server = 'mistral' + server_name
-        mistral_replicas = self._spec[server]['replicas']
+        mistral_replicas = 0 if self.is_scaled_down_by_disaster_recovery() \
+            else self._spec[server]['replicas']
         mistral_resources = self._spec[server]['resources']
         logger.debug("resources:" + str(mistral_resources))
         meta = V1ObjectMeta(labels=self.get_labels(
@@ -1451,39 +1530,6 @@ class KubernetesHelper:
         return body
 
     def generate_idp_params(self):
-        def get_client_creds(registration_token, client_name,
-                             idp_external_server):
-            headers = {"Authorization": "Bearer " + registration_token}
-            json = {
-                "client_name": client_name,
-                "grant_types": ["client_credentials", "redelegate"],
-                "scope": "profile"
-            }
-
-            res = requests.post(
-                idp_external_server + "/register",
-                headers=headers,
-                json=json,
-                verify=MC.IDP_CERT_FILE_PATH
-            ).json()
-
-            return res['client_id'], res['client_secret']
-
-        def get_jwk(auth_type, idp_external_server):
-            if auth_type == "keycloak-oidc":
-                res = requests.get(
-                    idp_external_server +
-                    "/auth/realms/cloud-common/protocol/openid-connect/certs",
-                    verify=MC.IDP_CERT_FILE_PATH
-                ).json()
-            else:
-                res = requests.get(
-                    idp_external_server + "/jwk",
-                    verify=MC.IDP_CERT_FILE_PATH
-                ).json()
-
-            return res['keys'][0]['e'], res['keys'][0]['n']
-
         auth_enabled = self.is_auth_enabled()
         auth_type = self._spec['mistralCommonParams']['auth']['type']
 
@@ -1501,7 +1547,6 @@ class KubernetesHelper:
                 "Error",
                 "IDP server was not provided"
             )
-            sleep(5)
             raise kopf.PermanentError("IDP server was not provided.")
 
         if not idp_external_server:
@@ -1509,15 +1554,10 @@ class KubernetesHelper:
                         "using idp server instead.")
             idp_external_server = idp_server
 
-        secret = self._v1_apps_api.read_namespaced_secret(
-            name=MC.MISTRAL_SECRET,
-            namespace=self._workspace
-        )
+        secret_data = self._snapshot.get_secret_data(MC.MISTRAL_SECRET)
 
-        secret_data = secret.data
-
-        idp_jwk_exp = self.decode_secret(secret_data['idp-jwk-exp'])
-        idp_jwk_mod = self.decode_secret(secret_data['idp-jwk-mod'])
+        idp_jwk_exp = secret_data['idp-jwk-exp']
+        idp_jwk_mod = secret_data['idp-jwk-mod']
 
         if idp_jwk_exp and idp_jwk_mod and \
                 idp_jwk_exp != 'null' and idp_jwk_mod != 'null':
@@ -1525,14 +1565,16 @@ class KubernetesHelper:
         else:
             logger.info("JWK values were not provided. "
                         "Generating JWK.")
-            idp_jwk_exp, idp_jwk_mod = get_jwk(
-                auth_type,
-                idp_external_server
-            )
+            try:
+                idp_jwk_exp, idp_jwk_mod = get_idp_client(
+                    idp_external_server).get_jwk(auth_type)
+            except requests.RequestException as exc:
+                raise kopf.TemporaryError(f"Could not get JWK from IDP: {exc}",
+                                          delay=MC.IDP_RETRY_DELAY)
 
             logger.info("Patching secret with JWK values.")
 
-            self._v1_apps_api.patch_namespaced_secret(
+            patched = self._v1_apps_api.patch_namespaced_secret(
                 name=MC.MISTRAL_SECRET,
                 namespace=self._workspace,
                 body={
@@ -1546,17 +1588,14 @@ class KubernetesHelper:
                     }
                 }
             )
+            self.invalidate('secret', MC.MISTRAL_SECRET, patched)
 
         if self.is_cloud_core_integration_enabled():
             username_changed = False
             if self.is_secret_present(MC.CLOUD_CORE_SECRET):
-                secret = self._v1_apps_api.read_namespaced_secret(
-                    name=MC.CLOUD_CORE_SECRET,
-                    namespace=self._workspace
-                )
-                secret_data = secret.data
-
-                current_username = self.decode_secret(secret_data['username'])
+                cloud_core_data = self._snapshot.get_secret_data(
+                    MC.CLOUD_CORE_SECRET)
+                current_username = cloud_core_data['username']
                 new_username = self.get_cloudcore_username()
                 if current_username != new_username:
                     logger.info(
@@ -1567,6 +1606,7 @@ class KubernetesHelper:
                         name=MC.CLOUD_CORE_SECRET,
                         namespace=self._workspace
                     )
+                    self.invalidate('secret', MC.CLOUD_CORE_SECRET)
                     username_changed = True
 
             if not self.is_secret_present(MC.CLOUD_CORE_SECRET):
@@ -1598,7 +1638,9 @@ class KubernetesHelper:
                 body.kind = 'Secret'
                 body.type = 'Opaque'
                 kopf.adopt(body)
-                self._v1_apps_api.create_namespaced_secret(self._workspace, body)
+                created = self._v1_apps_api.create_namespaced_secret(
+                    self._workspace, body)
+                self.invalidate('secret', MC.CLOUD_CORE_SECRET, created)
             return username_changed
 
         if self.is_idp_user_precreated():
@@ -1606,12 +1648,8 @@ class KubernetesHelper:
                         "skipping client generation.")
             return
 
-        idp_client_id = base64.b64decode(
-            secret_data['idp-client-id']
-        ).decode("utf-8")
-        idp_client_secret = base64.b64decode(
-            secret_data['idp-client-secret']
-        ).decode("utf-8")
+        idp_client_id = secret_data['idp-client-id']
+        idp_client_secret = secret_data['idp-client-secret']
 
         if idp_client_id and idp_client_secret and \
                 idp_client_id != 'null' and idp_client_secret != 'null':
@@ -1621,9 +1659,7 @@ class KubernetesHelper:
             logger.info("IDP client ID or client secret were not set."
                         "Generating using IDP registration token.")
 
-            idp_registration_token = base64.b64decode(
-                secret_data["idp-registration-token"]
-            ).decode("utf-8")
+            idp_registration_token = secret_data["idp-registration-token"]
 
             if not idp_registration_token or idp_registration_token == 'null':
                 logger.error("Could not generate IDP params:"
@@ -1633,19 +1669,22 @@ class KubernetesHelper:
                     "Error",
                     "IDP registration token was not provided"
                 )
-                sleep(5)
                 raise kopf.PermanentError("IDP registration token "
                                           "was not provided.")
 
-            idp_client_id, idp_client_secret = get_client_creds(
-                idp_registration_token,
-                'mistral_' + self._workspace,
-                idp_external_server
-            )
+            try:
+                idp_client_id, idp_client_secret = get_idp_client(
+                    idp_external_server).register_client(
+                        idp_registration_token, 'mistral_' + self._workspace,
+                        self.secret_hash(MC.MISTRAL_SECRET))
+            except requests.RequestException as exc:
+                raise kopf.TemporaryError(
+                    f"Could not register IDP client: {exc}",
+                    delay=MC.IDP_RETRY_DELAY)
 
             logger.info("Patching secret with IDP values.")
 
-            self._v1_apps_api.patch_namespaced_secret(
+            patched = self._v1_apps_api.patch_namespaced_secret(
                 name=MC.MISTRAL_SECRET,
                 namespace=self._workspace,
                 body={
@@ -1659,6 +1698,7 @@ class KubernetesHelper:
                     }
                 }
             )
+            self.invalidate('secret', MC.MISTRAL_SECRET, patched)
 
     def add_rmq_container_to_deployment(self, pod_template_spec):
         rmq_image = self._spec['mistralLite']['rabbitmq']['dockerImage']
@@ -1767,6 +1807,17 @@ class KubernetesHelper:
     def is_mistral_lite(self):
         return self._spec['mistral']['liteEnabled']
 
+    def is_scaled_down_by_disaster_recovery(self):
+        """Whether the site is requested or switched to standby or disable.
+
+        The reconcile keeps the Mistral deployments of such a site at zero
+        replicas, only the switchover to active scales them up.
+        """
+        mode = (self._spec.get('disasterRecovery') or {}).get('mode')
+        dr_status = self._cr_status.get('disasterRecoveryStatus') or {}
+        return mode in MC.SCALED_DOWN_DR_MODES \
+            or dr_status.get('mode') in MC.SCALED_DOWN_DR_MODES
+
     def is_auth_enabled(self):
         return self._spec['mistralCommonParams']['auth']['enable']
 
@@ -1801,74 +1852,74 @@ class KubernetesHelper:
         return labels
 
     def is_secret_present(self, name):
-        secrets = self._v1_apps_api.list_namespaced_secret(
-            namespace=self._workspace)
-        exists = list(
-            filter(lambda x: x.metadata.name == name, secrets.items))
-        return len(exists) != 0
+        return self._snapshot.get('secret', name) is not None
 
-    def is_secret_updated(self, name, time_delta=180):
-        secret = self._v1_apps_api.read_namespaced_secret(
-            name, namespace=self._workspace)
+    def secret_hash(self, name):
+        """Returns the hash of the secret keys the running services consume."""
+        data = self._snapshot.get_secret_data(name)
+        consumed = {key: data.get(key) for key in MC.SCALE_DOWN_SECRET_KEYS}
+        canonical = json.dumps(consumed, sort_keys=True)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
 
-        if not secret:
-            return False
+    def get_secret_hashes(self):
+        return self._status_writer.get_status().get('secretHashes') or {}
 
-        last_updated_time = secret.metadata.managed_fields[-1].time
-        current_time = datetime.now(timezone.utc)
-        update_time_delta = current_time - last_updated_time
-        if update_time_delta.seconds <= time_delta:
-            return True
-        else:
+    def is_secret_updated(self, name):
+        """Whether the consumed keys changed since the hash was recorded.
+
+        A secret without a recorded hash is not reported as updated, its
+        hash is recorded by the reconcile.
+        """
+        if not self.is_secret_present(name):
             return False
+        recorded = self.get_secret_hashes().get(name)
+        return recorded is not None and recorded != self.secret_hash(name)
+
+    def record_operator_version(self):
+        self._status_writer.set('operatorVersion', MC.OPERATOR_VERSION)
+
+    def record_secret_hash(self, name):
+        if not self.is_secret_present(name):
+            return
+        secret_hash = self.secret_hash(name)
+        self._status_writer.update(
+            'secretHashes', lambda hashes: {**(hashes or {}), name: secret_hash})
 
     def is_configmap_present(self, name):
-        config = self._v1_apps_api.list_namespaced_config_map(
-            namespace=self._workspace)
-        exists = list(
-            filter(lambda x: x.metadata.name == name, config.items))
-        return len(exists) != 0
-
-    def check_if_tests_are_failed(self, max_timeout=900):
-        time = 0
-        result = False
-        test_status = None
-        test_status_summary = None
-        ready_replicas = 0
-        expected_replicas = 1
+        return self._is_present('configmap', name)
+
+    def get_tests_result(self):
+        """Returns the type and the summary of the finished tests, None while they run."""
+        deployment_status = self._apps_api.read_namespaced_deployment_status(
+            MC.MISTRAL_OPERATOR, self._workspace)
+        for condition in deployment_status.status.conditions or []:
+            if condition.reason == "IntegrationTestsExecutionStatus":
+                if condition.type == "In Progress":
+                    return None
+                return condition.type, condition.message
+        return None
+
+    async def check_if_tests_are_failed(self, max_timeout=900):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
         # Wait till mistral integration tests are started successfully
-        while ready_replicas != expected_replicas and time < max_timeout:
-            deployment = self._apps_api.read_namespaced_deployment(
-                name=MC.MISTRAL_TESTS,
-                namespace=self._workspace
-            )
-            ready_replicas = deployment.status.ready_replicas
-            sleep(5)
-            time = time + 5
-
-        while test_status in (None, "In Progress") and time < max_timeout:
-            sleep(5)
-            deployment_status = self._apps_api.read_namespaced_deployment_status(
-                MC.MISTRAL_OPERATOR, self._workspace)
-            status_conditions = deployment_status.status.conditions
-            for condition in status_conditions:
-                if condition.reason == "IntegrationTestsExecutionStatus":
-                    test_status = condition.type
-                    test_status_summary = condition.message
-                    break
-            time = time + 5
-
-        if time >= max_timeout:
-            result = True
+        await self._cache.wait_for(
+            'deployment', MC.MISTRAL_TESTS,
+            lambda deployment: deployment is not None
+            and self.is_deployment_ready(deployment, 1),
+            max_timeout)
+        remaining = max(0, max_timeout - (loop.time() - started))
+
+        finished, test_result = await self.retry_policy('tests').poll(
+            self.get_tests_result, remaining)
+        if not finished:
             logger.info("Operator reached maximum waiting time to receive integration tests"
                         " result, please check mistral-tests logs for more information.")
-            return result
-
-        if test_status == "Failed":
-            result = True
+            return True
 
+        test_status, test_status_summary = test_result
         logger.info("Robot Tests result Summary: %s", test_status_summary)
-        return result
+        return test_status == "Failed"
 
     def generate_mistral_common_configmap_body(self):
         metadata = client.V1ObjectMeta(
@@ -1934,11 +1985,12 @@ class KubernetesHelper:
             configmap = V1ConfigMap(data=configmapdata, kind='ConfigMap',
                                     metadata=metadata)
             kopf.adopt(configmap)
-            self._v1_apps_api.create_namespaced_config_map(
+            created = self._v1_apps_api.create_namespaced_config_map(
                 namespace=self._workspace,
                 body=configmap)
+            self.invalidate('configmap', MC.RABBIT_CONFIGMAP, created)
 
-    def create_mistral_service(self):
+    def apply_mistral_service(self):
         service_spec = \
             V1ServiceSpec(selector={'deploymentconfig': MC.SELECTOR},
                           ports=[V1ServicePort(
@@ -1953,10 +2005,9 @@ class KubernetesHelper:
         service = V1Service(spec=service_spec,
                             metadata=V1ObjectMeta(labels={'app': MC.MISTRAL_LABEL},
                                                   name=MC.MISTRAL_SERVICE))
-        kopf.adopt(service)
-        self._v1_apps_api.create_namespaced_service(self._workspace, service)
+        self.apply_object('service', service)
 
-    def create_mistral_monitoring_service(self):
+    def apply_mistral_monitoring_service(self):
         service_spec = \
             V1ServiceSpec(selector={'deploymentconfig': 'mistral-monitoring'},
                           ports=[V1ServicePort(
@@ -1967,89 +2018,115 @@ class KubernetesHelper:
         service = V1Service(spec=service_spec,
                             metadata=V1ObjectMeta(labels={'app': 'mistral-monitoring'},
                                                   name='mistral-monitoring'))
-        kopf.adopt(service)
-        self._v1_apps_api.create_namespaced_service(self._workspace, service)
+        self.apply_object('service', service)
 
     def update_mistral_common_configmap(self):
         configmap = self.generate_mistral_common_configmap_body()
-        kopf.adopt(configmap)
-        if not self.is_configmap_present(MC.COMMON_CONFIGMAP):
-            self._v1_apps_api.create_namespaced_config_map(
-                namespace=self._workspace,
-                body=configmap
-            )
-        else:
-            self._v1_apps_api.replace_namespaced_config_map(
-                namespace=self._workspace,
-                body=configmap,
-                name=MC.COMMON_CONFIGMAP
-            )
+        self.apply_object('configmap', configmap)
 
     def is_db_update_job_present(self):
-        jobs = self._batch_v1_api.list_namespaced_job(
-            namespace=self._workspace)
-        exists = list(
-            filter(lambda x: x.metadata.name == MC.UPDATE_DB_JOB,
-                   jobs.items))
-        return len(exists) != 0
-
-    def update_db_job(self):
+        return self._is_present('job', MC.UPDATE_DB_JOB)
+
+    async def update_db_job(self):
+        if not await asyncio.to_thread(self.is_migration_needed):
+            logger.info("Database schema is already migrated by %s image,"
+                        " skipping Update-db job",
+                        self._spec['mistral']['dockerImage'])
+            return
         logger.info("Running Update-db job")
-        delopt = V1DeleteOptions(propagation_policy='Background',
-                                 grace_period_seconds=0)
-        if self.is_db_update_job_present():
-            logger.info("Deleting old update db job")
-            self._batch_v1_api.delete_namespaced_job(
-                namespace=self._workspace,
-                name=MC.UPDATE_DB_JOB,
-                body=delopt
-            )
-        while self.is_db_update_job_present():
-            logger.info("Waiting until old update db job deleted")
-            sleep(3)
-        self.apply_update_db_job()
+        await self.apply_update_db_job()
+        await asyncio.to_thread(self.record_migration)
+
+    def get_migration_target(self):
+        postgres = self._spec['mistralCommonParams'].get('postgres') or {}
+        return {
+            'image': self._spec['mistral']['dockerImage'],
+            'database': f"{postgres.get('host')}:{postgres.get('port')}/"
+                        f"{postgres.get('dbName')}",
+        }
 
-    def cleanup_job(self):
-        delopt = V1DeleteOptions(propagation_policy='Background',
-                                 grace_period_seconds=0)
-        if self.is_cleanup_job_present():
-            logger.info("Deleting old cleanup job")
-            self._batch_v1_api.delete_namespaced_job(
-                namespace=self._workspace,
-                name=MC.CLEANUP_JOB,
-                body=delopt
-            )
-        while self.is_cleanup_job_present():
-            logger.info("Waiting until old cleanup job deleted")
-            sleep(3)
+    @staticmethod
+    def get_image_digest(image_id):
+        """Returns the digest of the container image ID, None if it has none."""
+        _, separator, digest = (image_id or '').rpartition('@')
+        return digest if separator else None
+
+    def get_image_digests(self, app, image):
+        """Returns the digests the pods of the app run the image with.
+
+        A tag pushed again points to another image, the digests of the
+        started containers tell which one the pods actually run.
+        """
+        pods = self._v1_apps_api.list_namespaced_pod(
+            namespace=self._workspace, label_selector=f'app={app}',
+            timeout_seconds=10)
+        digests = set()
+        for pod in pods.items:
+            images = {container.name: container.image
+                      for container in pod.spec.containers}
+            for container in (pod.status and pod.status.container_statuses) \
+                    or []:
+                digest = self.get_image_digest(container.image_id)
+                if digest and images.get(container.name) == image:
+                    digests.add(digest)
+        return digests
+
+    def is_migration_needed(self):
+        if self._spec['mistralUpdateDbPod'].get('forceMigration'):
+            logger.info("Database migration is forced")
+            return True
+        migration = self._status_writer.get_status().get('migration') or {}
+        target = self.get_migration_target()
+        if any(migration.get(key) != value for key, value in target.items()):
+            return True
+        recorded = migration.get('imageDigests')
+        if not recorded:
+            return False
+        running = self.get_image_digests(MC.MISTRAL_LABEL, target['image'])
+        if running - set(recorded):
+            logger.info("Mistral pods run %s image with digests %s, the"
+                        " database schema is migrated with %s",
+                        target['image'], sorted(running), recorded)
+            return True
+        return False
+
+    def record_migration(self):
+        migration = self.get_migration_target()
+        migration['time'] = datetime.now(timezone.utc).isoformat()
+        # The update-db job pulls the image always, the running Mistral pods
+        # are accounted for too so that a node cache does not rerun the job
+        digests = self.get_image_digests(MC.UPDATE_DB_JOB, migration['image'])
+        if digests:
+            digests |= self.get_image_digests(MC.MISTRAL_LABEL,
+                                              migration['image'])
+            migration['imageDigests'] = sorted(digests)
+        self._status_writer.set('migration', migration)
+
+    async def cleanup_job(self):
         logger.info("Running Cleanup job")
-        self.apply_cleanup_job()
-
-    def apply_cleanup_job(self):
-        attempts = 36
-        sleep_between_iterations = 20
-        jobbody = self.generate_cleanup_job_body()
-        kopf.adopt(jobbody)
-        self._batch_v1_api.create_namespaced_job(self._workspace, jobbody)
-        while attempts > 0:
-            sleep(sleep_between_iterations)
-            cleanup_db_job_status, cleanup_db_job_doc = self.get_job_status(job_name=MC.CLEANUP_JOB)
-            if cleanup_db_job_status:
-                break
-            attempts = attempts - 1
-        if attempts == 0 or cleanup_db_job_status == MC.Status.FAILED:
-            job_logs = self.get_job_logs(job_doc=cleanup_db_job_doc)
+        await self.apply_cleanup_job()
+
+    async def apply_cleanup_job(self):
+        jobbody = await asyncio.to_thread(self.generate_cleanup_job_body)
+        await self.recreate_job(jobbody)
+        cleanup_db_job_status, cleanup_db_job_doc = \
+            await self.wait_for_job_completion(MC.CLEANUP_JOB)
+        if cleanup_db_job_status != MC.Status.SUCCESSFUL:
+            job_logs = await asyncio.to_thread(
+                self.get_job_logs, job_doc=cleanup_db_job_doc)
             logger.error(
                 "Error with Mistral cleanup db job. Following are failure logs"
                 " from Mistral cleanup db job %s", job_logs
             )
-            self.update_status(
+            logs_configmap = await asyncio.to_thread(
+                self.store_job_logs, MC.CLEANUP_JOB, job_logs)
+            await asyncio.to_thread(
+                self.update_status,
                 MC.Status.FAILED,
                 "Error",
-                "Error with Mistral cleanup db job. Following are failure logs"
-                " from Mistral cleanup db job %s" % job_logs
+                "Error with Mistral cleanup db job. Failure logs are stored"
+                f" in the {logs_configmap} config map."
             )
-            sleep(5)
             raise kopf.PermanentError("Error with Mistral cleanup db job.")
 
     def generate_cleanup_job_body(self):
@@ -2309,14 +2386,6 @@ class KubernetesHelper:
                              kind='Job', spec=job_spec)
         return job_template
 
-    def is_cleanup_job_present(self):
-        jobs = self._batch_v1_api.list_namespaced_job(
-            namespace=self._workspace)
-        exists = list(
-            filter(lambda x: x.metadata.name == MC.CLEANUP_JOB,
-                   jobs.items))
-        return len(exists) != 0
-
     def should_cleanup(self):
         return self._spec.get('mistralCommonParams', {}).get('cleanup', False)
 
@@ -2352,91 +2421,142 @@ class KubernetesHelper:
             return enabled.lower() == 'true'
         return False
 
+    @staticmethod
+    def get_timestamp():
+        return datetime.now(timezone.utc).isoformat()
+
+    @staticmethod
+    def generate_condition(status_type, message, error=None):
+        condition = {
+            'type': status_type,
+            'status': True,
+            'message': message,
+            'lastTransitionTime': KubernetesHelper.get_timestamp(),
+        }
+        if error is not None:
+            condition['reason'] = error
+        return condition
+
     def initiate_status(self):
-        cr = self.get_custom_resource()
-        logger.info(cr)
-        conditions = []
-        in_progress = V1ComponentCondition(
-            type=MC.Status.IN_PROGRESS,
-            status=True,
-            message="Mistral operator started deploy process",
-        )
-        conditions.append(in_progress)
-        status = V1ComponentStatus(conditions=conditions)
-        cr['status'] = status
-        self.update_custom_resource(cr)
+        in_progress = self.generate_condition(
+            MC.Status.IN_PROGRESS, "Mistral operator started deploy process")
+        self._status_writer.reset_conditions(in_progress)
+        self._status_writer.flush()
 
     def update_status(self, status_type, error, message):
-        cr = self.get_custom_resource()
-        conditions = cr['status']['conditions']
-        new_condition = V1ComponentCondition(
-            type=status_type,
-            status=True,
-            message=message,
-            error=error,
-        )
-        conditions.append(new_condition)
-        cr['status']['conditions'] = conditions
-        self.update_custom_resource(cr)
+        new_condition = self.generate_condition(status_type, message, error)
+        self._status_writer.add_condition(new_condition)
+
+    @staticmethod
+    def get_spec_revision(spec):
+        """Returns the hash of the spec the reconcile checkpoints belong to.
+
+        The disaster recovery section is left out: a mode change does not
+        reconcile the resources, so it keeps the progress of a preempted
+        reconcile.
+        """
+        reconciled = {key: value for key, value in spec.items()
+                      if key != 'disasterRecovery'}
+        canonical = json.dumps(reconciled, sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get_completed_steps(self):
+        """Returns the reconcile steps completed for the current spec."""
+        progress = self._status_writer.get_status().get('reconcileProgress') \
+            or {}
+        if self._revision is None \
+                or progress.get('revision') != self._revision:
+            return []
+        return progress.get('completedSteps') or []
+
+    def is_step_completed(self, name):
+        return name in self.get_completed_steps()
+
+    def complete_step(self, name):
+        """Records the step as completed, the checkpoint is written at once."""
+        if self._revision is None:
+            return
+        revision = self._revision
+
+        def add_step(progress):
+            progress = progress or {}
+            steps = list(progress.get('completedSteps') or []) \
+                if progress.get('revision') == revision else []
+            if name not in steps:
+                steps.append(name)
+            return {'revision': revision, 'completedSteps': steps}
+
+        with self._steps_lock:
+            self._status_writer.update('reconcileProgress', add_step)
+            self._status_writer.flush()
+
+    async def run_step(self, name, step):
+        """Runs the reconcile step unless it is completed for the spec.
+
+        A handler retried or resumed after an operator restart skips the
+        steps the interrupted run already completed.
+        """
+        if await asyncio.to_thread(self.is_step_completed, name):
+            logger.info("Reconcile step %s is already completed for"
+                        " spec revision %s, skipping", name, self._revision[:12])
+            return
+        await step()
+        await asyncio.to_thread(self.complete_step, name)
 
-    def check_mistral_service_ready(self, service):
-        deployment = self._apps_api.read_namespaced_deployment(
-            name=service,
-            namespace=self._workspace
-        )
-        ready_replicas = deployment.status.ready_replicas
+    def flush_status(self):
+        self._status_writer.flush()
+
+    def get_expected_replicas(self, service):
         if service in MC.SERVICES_NAME_TO_SERVER:
             spec = self._spec['mistral' + MC.SERVICES_NAME_TO_SERVER[service]]
-            replicas = int(spec['replicas'])
-        else:
-            replicas = 1
-        return ready_replicas == replicas
+            return int(spec['replicas'])
+        return 1
+
+    @staticmethod
+    def is_deployment_ready(deployment, replicas):
+        """Whether the current generation has all the replicas ready.
+
+        An absent deployment does not block the readiness.
+        """
+        if deployment is None:
+            return True
+        status = deployment.status
+        if status is None or (status.observed_generation or 0) \
+                < (deployment.metadata.generation or 0):
+            return False
+        return (status.ready_replicas or 0) == replicas
 
-    def wait_mistral_ready(self, check_interval=10):
+    async def wait_mistral_ready(self):
         wait_time = self._spec['integrationTests']['mistralReadyTimeout']
-        mistral_ready = False
-        time = 0
-        while not mistral_ready and time < wait_time:
-            logger.info("Waiting until Mistral is ready")
-            sleep(check_interval)
-            time = time + check_interval
-            mistral_ready = True
-            if self.is_mistral_lite():
-                if self.is_deployment_present(MC.MISTRAL_SERVICE):
-                    if not self.check_mistral_service_ready(MC.MISTRAL_SERVICE):
-                        mistral_ready = False
-            else:
-                for service in MC.MISTRAL_SERVICES:
-                    if self.is_deployment_present(service):
-                        if not self.check_mistral_service_ready(service):
-                            mistral_ready = False
-                            break
-        return mistral_ready
-
-    def run_tests(self):
+        services = [MC.MISTRAL_SERVICE] if self.is_mistral_lite() \
+            else MC.MISTRAL_SERVICES
+        logger.info("Waiting until Mistral is ready")
+        results = await asyncio.gather(*(
+            self._cache.wait_for(
+                'deployment', service,
+                functools.partial(self.is_deployment_ready,
+                                  replicas=self.get_expected_replicas(service)),
+                wait_time)
+            for service in services
+        ))
+        return all(ready for ready, _ in results)
+
+    async def run_tests(self):
         logger.info('Integration tests enabled.')
-        if not self.is_service_present(MC.MISTRAL_TESTS):
-            logger.info('Creating robot tests service.')
-            self.create_robot_tests_service()
-        else:
-            logger.info('Robot tests service already present.')
+        await asyncio.to_thread(self.apply_robot_tests_service)
 
-        template = self.generate_robot_tests_pod_template_body()
-        kopf.adopt(template)
-
-        if self.is_deployment_present(MC.MISTRAL_TESTS):
+        if await asyncio.to_thread(self.is_deployment_present, MC.MISTRAL_TESTS):
             logger.info('Recreating tests deployment.')
-            self.delete_deployment(MC.MISTRAL_TESTS)
-
-        while self.is_deployment_present(MC.MISTRAL_TESTS):
-            logger.info("Waiting for older deployment to be deleted.")
-            sleep(5)
+            await asyncio.to_thread(self.delete_deployment, MC.MISTRAL_TESTS)
+            await self.wait_for_deletion('deployment', MC.MISTRAL_TESTS)
 
         logger.info('Creating robot tests deployment.')
-        kopf.adopt(template)
-        self._apps_api.create_namespaced_deployment(
-            self._workspace, template
-        )
+        await asyncio.to_thread(self.create_robot_tests_deployment)
+
+    def create_robot_tests_deployment(self):
+        template = self.generate_robot_tests_pod_template_body()
+        self.prepare_object(template)
+        self.apply_manifest('deployment', template)
 
     def generate_robot_tests_pod_template_body(self):
         tests_params = self._spec['integrationTests']
@@ -2691,7 +2811,7 @@ class KubernetesHelper:
 
         return body
 
-    def create_robot_tests_service(self):
+    def apply_robot_tests_service(self):
         service_spec = V1ServiceSpec(
             selector={
                 'app': MC.MISTRAL_TESTS
@@ -2712,67 +2832,257 @@ class KubernetesHelper:
                 name=MC.MISTRAL_TESTS
             )
         )
-        kopf.adopt(service)
-        self._v1_apps_api.create_namespaced_service(self._workspace, service)
+        self.apply_object('service', service)
+
+    def _is_present(self, kind, name):
+        present = self._cache.contains(kind, name)
+        if present is None:
+            objects = self._apis.list_metadata(
+                kind, self._workspace,
+                fieldSelector=f'metadata.name={name}', limit=1)
+            present = bool(objects.get('items'))
+        return present
+
+    def get_cache_stats(self):
+        return self._cache.stats()
+
+    def get_rabbitmq_stats(self):
+        if self._rmq_helper is None:
+            return {}
+        return self._rmq_helper.get_latency_stats()
+
+    def invalidate(self, kind, name, written=None):
+        """Forgets the object after the operator wrote it.
+
+        :param written: the object returned by the write, if any.
+        """
+        self._cache.invalidate(kind, name, written)
+        self._snapshot.invalidate(kind, name)
+
+    def spec_hash(self, body):
+        """Returns the canonical hash of the generated object body."""
+        body = self._api_client.sanitize_for_serialization(body)
+        annotations = body.get('metadata', {}).get('annotations') or {}
+        annotations.pop(MC.SPEC_HASH_ANNOTATION, None)
+        canonical = json.dumps(body, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def prepare_object(self, body):
+        """Adopts the generated object and annotates it with its spec hash."""
+        kopf.adopt(body)
+        spec_hash = self.spec_hash(body)
+        annotations = dict(body.metadata.annotations or {})
+        annotations[MC.SPEC_HASH_ANNOTATION] = spec_hash
+        body.metadata.annotations = annotations
+        return spec_hash
+
+    def get_live_object(self, kind, name):
+        known, obj = self._cache.get(kind, name)
+        if not known:
+            try:
+                obj = self._read_funcs[kind](name, self._workspace)
+            except client.rest.ApiException as exc:
+                if exc.status != 404:
+                    raise
+                obj = None
+        return obj
+
+    @staticmethod
+    def is_up_to_date(live, annotations, body, spec_hash):
+        if annotations.get(MC.SPEC_HASH_ANNOTATION) != spec_hash:
+            return False
+        # Scaling changes the replicas but keeps the annotation.
+        replicas = getattr(getattr(body, 'spec', None), 'replicas', None)
+        return replicas is None \
+            or live is not None and live.spec.replicas == replicas
+
+    @staticmethod
+    def get_replicas_manager(live):
+        """Returns the autoscaler owning the replicas of the live deployment."""
+        for entry in live.metadata.managed_fields or []:
+            fields = (entry.fields_v1 or {}).get('f:spec', {})
+            if 'f:replicas' in fields \
+                    and entry.manager in MC.EXTERNAL_REPLICAS_MANAGERS:
+                return entry.manager
+        return None
+
+    def apply_object(self, kind, body):
+        """Applies the object unless the cached one has the same spec hash.
+
+        Returns 'created', 'updated' or 'unchanged'.
+        """
+        name = body.metadata.name
+        live = None
+        if kind == 'deployment':
+            _, live = self._cache.get(kind, name)
+        if live is not None:
+            manager = self.get_replicas_manager(live)
+            if manager:
+                logger.debug("Replicas of %s are managed by %s", name, manager)
+                body.spec.replicas = None
+        spec_hash = self.prepare_object(body)
+        annotations = self._cache.get_annotations(kind, name)
+        if annotations is not None \
+                and self.is_up_to_date(live, annotations, body, spec_hash):
+            result = 'unchanged'
+        elif self.apply_manifest(kind, body):
+            result = 'created'
+        else:
+            logger.info("Updated %s %s.", name, kind)
+            result = 'updated'
+        self.count_apply(result)
+        return result
+
+    @staticmethod
+    def merge_fields(fields, other):
+        """Adds the field set of another manager to the fields."""
+        for key, value in other.items():
+            if isinstance(value, dict) and isinstance(fields.get(key), dict):
+                KubernetesHelper.merge_fields(fields[key], value)
+            else:
+                fields[key] = copy.deepcopy(value)
+        return fields
+
+    @staticmethod
+    def upgrade_managed_fields(managed_fields, api_version):
+        """Hands the fields of the legacy client-side writes to the operator.
+
+        The objects written by the previous operator versions with create
+        and replace are owned by their Update managers, so the fields the
+        operator stops generating would never be removed by the apply. The
+        fields are moved to the Apply entry of MC.FIELD_MANAGER, the way
+        kubectl upgrades the objects to server-side apply. Returns the new
+        managed fields, None if there is nothing to hand over.
+        """
+        legacy = [entry for entry in managed_fields
+                  if entry.get('manager') in MC.LEGACY_FIELD_MANAGERS
+                  and entry.get('operation') == 'Update'
+                  and not entry.get('subresource')]
+        if not legacy:
+            return None
+        applied = [entry for entry in managed_fields
+                   if entry.get('manager') == MC.FIELD_MANAGER
+                   and entry.get('operation') == 'Apply']
+        fields = {}
+        for entry in applied + legacy:
+            KubernetesHelper.merge_fields(fields, entry.get('fieldsV1') or {})
+        upgraded = {
+            'manager': MC.FIELD_MANAGER,
+            'operation': 'Apply',
+            'apiVersion': api_version,
+            'fieldsType': 'FieldsV1',
+            'fieldsV1': fields,
+        }
+        if legacy[-1].get('time'):
+            upgraded['time'] = legacy[-1]['time']
+        return [entry for entry in managed_fields
+                if entry not in legacy and entry not in applied] + [upgraded]
+
+    def migrate_managed_fields(self, kind, name):
+        """Upgrades the cached object to server-side apply once."""
+        metadata = self._cache.get_metadata(kind, name)
+        if not metadata:
+            return
+        managed_fields = self.upgrade_managed_fields(
+            metadata.get('managedFields') or [],
+            self.MANIFEST_KINDS[kind][0])
+        if managed_fields is None:
+            return
+        logger.info("Moving the fields of %s %s to the %s field manager",
+                    kind, name, MC.FIELD_MANAGER)
+        try:
+            with get_switchover_lane().write_guard():
+                migrated = self._apis.replace_managed_fields(
+                    kind, self._workspace, name,
+                    metadata['resourceVersion'], managed_fields)
+        except client.rest.ApiException as exc:
+            # A changed object is migrated by the next apply
+            if exc.status not in (404, 409, 422):
+                raise
+            logger.info("%s %s changed while its managed fields were"
+                        " migrated: %s", kind, name, exc.reason)
+            return
+        self.invalidate(kind, name, migrated)
+
+    def apply_manifest(self, kind, body):
+        """Server-side applies the object, returns whether it was created."""
+        manifest = self._api_client.sanitize_for_serialization(body)
+        manifest['apiVersion'], manifest['kind'] = self.MANIFEST_KINDS[kind]
+        name = manifest['metadata']['name']
+        self.migrate_managed_fields(kind, name)
+        with get_switchover_lane().write_guard():
+            applied, status = self._apis.apply(kind, self._workspace, name,
+                                               manifest, MC.FIELD_MANAGER)
+        self.invalidate(kind, name, applied)
+        return status == 201
+
+    def count_apply(self, result):
+        with self._apply_stats_lock:
+            self.apply_stats[result] += 1
+
+    def retry_policy(self, name):
+        return get_retry_policy(name, self._spec)
+
+    def update_apply_status(self):
+        logger.info("Reconciled objects: %s", self.apply_stats)
+        self._status_writer.set('reconciledObjects', dict(self.apply_stats))
 
     def is_deployment_present(self, name):
-        deployments = self._apps_api.list_namespaced_deployment(
-            namespace=self._workspace)
-        exists = list(
-            filter(lambda x: x.metadata.name == name,
-                   deployments.items))
-        return len(exists) != 0
-
-    def delete_lite_deployment(self, name):
-        if self.is_deployment_present(name):
-            self.delete_deployment(name)
-            sleep(90)
-
-    def update_deployment(self, name, server_name):
-        logger.info("Updating %s deployment.", name)
-        deployment_body = self.generate_deployment_config_body(name, server_name)
-        kopf.adopt(deployment_body)
-        self._apps_api.replace_namespaced_deployment(
-            name=name,
-            namespace=self._workspace,
-            body=deployment_body)
+        return self._is_present('deployment', name)
 
-    def update_lite_deployment(self, name):
-        deployment_body = self.generate_lite_deployment_config_body(name)
-        kopf.adopt(deployment_body)
-        if self.is_deployment_present(name):
-            self._apps_api.patch_namespaced_deployment(
-                name=name,
-                namespace=self._workspace,
-                body=deployment_body)
-        else:
-            self._apps_api.create_namespaced_deployment(
-                namespace=self._workspace,
-                body=deployment_body)
+    async def delete_lite_deployment(self, name):
+        if await asyncio.to_thread(self.is_deployment_present, name):
+            # The deployment is removed only after its pods are gone
+            await asyncio.to_thread(self.delete_deployment, name,
+                                    propagation_policy='Foreground')
+            await self.wait_for_deletion('deployment', name)
+
+    def apply_mistral_deployment(self, name):
+        server_name = MC.SERVICES_NAME_TO_SERVER[name]
+        deployment_body = self.generate_deployment_config_body(name, server_name)
+        result = self.apply_object('deployment', deployment_body)
+        logger.info("Deployment %s is %s.", name, result)
+
+    async def rollout_mistral_deployments(self, resources=None):
+        """Runs update-db and then updates the Mistral deployments at once.
+
+        :param resources: names of the job and deployments to roll out,
+            all of them by default.
+        """
+        steps = {}
+        if resources is None or MC.UPDATE_DB_JOB in resources:
+            steps[MC.UPDATE_DB_JOB] = self.update_db_job
+        for service in MC.MISTRAL_SERVICES:
+            if resources is None or service in resources:
+                steps[service] = functools.partial(
+                    asyncio.to_thread, self.apply_mistral_deployment, service)
+        steps = {
+            name: functools.partial(self.run_step, name, step)
+            for name, step in steps.items()
+        }
+        await run_steps(steps, MC.MISTRAL_ROLLOUT_DEPENDENCIES)
 
     def is_service_present(self, name):
-        services = self._v1_apps_api.list_namespaced_service(
-            namespace=self._workspace)
-        exists = list(
-            filter(lambda x: x.metadata.name == name,
-                   services.items))
-        return len(exists) != 0
+        return self._is_present('service', name)
 
     def delete_mistral_secret(self):
         self._v1_apps_api.delete_namespaced_secret(name=MC.MISTRAL_SECRET,
                                                    namespace=self._workspace)
+        self.invalidate('secret', MC.MISTRAL_SECRET)
 
     def delete_configmap(self, name):
         delopt = V1DeleteOptions(propagation_policy='Background',
                                  grace_period_seconds=0)
         self._v1_apps_api.delete_namespaced_config_map(
             name=name, namespace=self._workspace, body=delopt)
+        self.invalidate('configmap', name)
 
     def delete_db_job(self):
         self._batch_v1_api.delete_namespaced_job(namespace=self._workspace,
                                                  name=MC.UPDATE_DB_JOB)
+        self.invalidate('job', MC.UPDATE_DB_JOB)
 
-    def delete_deployment(self, name, force=None):
+    def delete_deployment(self, name, force=None, propagation_policy=None):
         if force:
             delopt = V1DeleteOptions(propagation_policy='Background',
                                      grace_period_seconds=0)
@@ -2781,11 +3091,18 @@ class KubernetesHelper:
                 namespace=self._workspace,
                 body=delopt
             )
+        elif propagation_policy:
+            self._apps_api.delete_namespaced_deployment(
+                name=name,
+                namespace=self._workspace,
+                body=V1DeleteOptions(propagation_policy=propagation_policy)
+            )
         else:
             self._apps_api.delete_namespaced_deployment(
                 name=name,
                 namespace=self._workspace
             )
+        self.invalidate('deployment', name)
 
     def delete_mistral_service(self):
         delopt = V1DeleteOptions(propagation_policy='Background',
@@ -2793,68 +3110,89 @@ class KubernetesHelper:
         self._v1_apps_api.delete_namespaced_service(namespace=self._workspace,
                                                     name=MC.MISTRAL_SERVICE,
                                                     body=delopt)
+        self.invalidate('service', MC.MISTRAL_SERVICE)
 
-    def scale_down_mistral_deployments(self, attempts=6, timeout=10):
+    def set_deployment_replicas(self, deployment, replicas):
+        with get_switchover_lane().write_guard():
+            scale = self._apps_api.patch_namespaced_deployment_scale(
+                deployment, self._workspace, {'spec': {'replicas': replicas}}
+            )
+        self.invalidate('deployment', deployment, scale)
+
+    async def set_mistral_deployments_replicas(self, replicas):
+        await asyncio.gather(*(
+            asyncio.to_thread(self.set_deployment_replicas,
+                              deployment, replicas[deployment])
+            for deployment in MC.MISTRAL_SERVICES
+        ))
+
+    async def wait_mistral_deployments(self, is_done, timeout, started):
+        """Waits until is_done(name, deployment) is true for every deployment.
+
+        The deployments are followed by the watch of the object cache, so
+        the wait ends on the event which completes the last of them.
+        Returns the seconds since ``started`` (event loop time) each
+        deployment took, None for the ones not done before the timeout.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def wait(deployment):
+            done, _ = await self._cache.wait_for(
+                'deployment', deployment,
+                functools.partial(is_done, deployment), timeout)
+            return deployment, round(loop.time() - started, 3) if done else None
+
+        return dict(await asyncio.gather(*(
+            wait(deployment) for deployment in MC.MISTRAL_SERVICES
+        )))
+
+    async def purge_mistral_queues(self):
+        await self.scale_down_mistral_deployments()
+        await asyncio.to_thread(self.delete_existing_queues)
+
+    async def scale_down_mistral_deployments(self):
+        """Scales the deployments down, returns the seconds each one took."""
         logger.info("Mistral scale down started")
         for deployment in MC.MISTRAL_SERVICES:
-            if not self.is_deployment_present(deployment):
+            if not await asyncio.to_thread(self.is_deployment_present, deployment):
                 logger.info("Can not scale down mistral: no deployment found.")
-                return
-            scale = self._apps_api.read_namespaced_deployment_scale(
-                deployment, self._workspace
-            )
-            scale.spec.replicas = 0
-            self._apps_api.patch_namespaced_deployment_scale(
-                deployment, self._workspace, scale
-            )
-
-        while attempts:
-            services_down = 0
-            for deployment in MC.MISTRAL_SERVICES:
-                dp_status = self._apps_api.read_namespaced_deployment_status(
-                    deployment, self._workspace
-                )
-                if not dp_status.status.replicas:
-                    services_down += 1
-            if services_down == len(MC.MISTRAL_SERVICES):
-                logger.info("Mistral scale down completed")
-                return
-            attempts -= 1
-            logger.info("Mistral scale down is not completed yet, waiting...")
-            sleep(timeout)
-        logger.info("Mistral was not scaled down during switchover process")
+                return {}
+        started = asyncio.get_running_loop().time()
+        await self.set_mistral_deployments_replicas(
+            dict.fromkeys(MC.MISTRAL_SERVICES, 0))
+
+        def is_scaled_down(deployment, obj):
+            return obj is None or not obj.status.replicas
+
+        timings = await self.wait_mistral_deployments(
+            is_scaled_down, self.retry_policy('scaleDown').deadline, started)
+        if None not in timings.values():
+            logger.info("Mistral scale down completed: %s", timings)
+        else:
+            logger.info("Mistral was not scaled down during switchover process")
+        return timings
 
-    def scale_up_mistral_deployments(self, attempts=12, timeout=10):
+    async def scale_up_mistral_deployments(self):
+        """Scales the deployments up, returns the seconds each one took."""
         logger.info("Mistral scale up started")
-        replicas = {}
-        for service in MC.MISTRAL_SERVICES:
-            spec = self._spec['mistral' + MC.SERVICES_NAME_TO_SERVER[service]]
-            replicas[service] = int(spec['replicas'])
-        for deployment in MC.MISTRAL_SERVICES:
-            scale = self._apps_api.read_namespaced_deployment_scale(
-                deployment, self._workspace
-            )
-            scale.spec.replicas = replicas[deployment]
-            self._apps_api.patch_namespaced_deployment_scale(
-                deployment, self._workspace, scale
-            )
+        started = asyncio.get_running_loop().time()
+        replicas = {
+            service: self.get_expected_replicas(service)
+            for service in MC.MISTRAL_SERVICES
+        }
+        await self.set_mistral_deployments_replicas(replicas)
 
-        while attempts:
-            services_ready = 0
-            for deployment in MC.MISTRAL_SERVICES:
-                dp_status = self._apps_api.read_namespaced_deployment_status(
-                    deployment, self._workspace
-                )
-                available_replicas = dp_status.status.available_replicas
-                if available_replicas and available_replicas == replicas[deployment]:
-                    services_ready += 1
-            if services_ready == len(MC.MISTRAL_SERVICES):
-                logger.info("Mistral scale up completed")
-                return
-            attempts -= 1
-            logger.info("Mistral scale up is not completed yet, waiting...")
-            sleep(timeout)
-        logger.info("Mistral was not scaled up during switchover process")
+        def is_scaled_up(deployment, obj):
+            return obj is not None \
+                and (obj.status.available_replicas or 0) == replicas[deployment]
+
+        timings = await self.wait_mistral_deployments(
+            is_scaled_up, self.retry_policy('scaleUp').deadline, started)
+        if None not in timings.values():
+            logger.info("Mistral scale up completed: %s", timings)
+        else:
+            logger.info("Mistral was not scaled up during switchover process")
+        return timings
 
     def get_custom_resource(self):
         cr = self._custom_objects_api.get_namespaced_custom_object(
@@ -2866,6 +3204,11 @@ class KubernetesHelper:
         )
         return cr
 
+    async def wait_for_custom_resource(self, predicate, timeout):
+        """Waits on the cached custom resource, see ObjectCache.wait_for."""
+        return await self._cache.wait_for(MC.CR_KIND, MC.CR_NAME, predicate,
+                                          timeout)
+
     def update_custom_resource(self, body):
         self._custom_objects_api.patch_namespaced_custom_object(
             group=MC.CR_GROUP,
@@ -2876,35 +3219,49 @@ class KubernetesHelper:
             body=body
         )
 
-    def set_deploy_status_and_run_tests(self):
-        if not self.wait_mistral_ready():
-            self.update_status(
+    async def set_deploy_status_and_run_tests(self):
+        if not self.is_mistral_lite() \
+                and self.is_scaled_down_by_disaster_recovery():
+            logger.info("Mistral is scaled down by disaster recovery,"
+                        " skipping readiness check and tests")
+            await asyncio.to_thread(
+                self.update_status,
+                MC.Status.SUCCESSFUL,
+                "None",
+                "Mistral service installed and kept scaled down by"
+                " disaster recovery"
+            )
+            return
+        if not await self.wait_mistral_ready():
+            await asyncio.to_thread(
+                self.update_status,
                 MC.Status.FAILED,
                 "Error",
                 "Mistral service unavailable"
             )
-            sleep(5)
             raise kopf.PermanentError("Mistral service unavailable.")
         if not self.wait_test_result() or not self.integration_tests_enabled():
-            self.update_status(
+            await asyncio.to_thread(
+                self.update_status,
                 MC.Status.SUCCESSFUL,
                 "None",
                 "Mistral service installed successfully"
             )
         if self.integration_tests_enabled():
             if self.wait_test_result() and not self.run_benchmarks():
-                self.run_tests()
+                await self.run_tests()
                 max_timeout = self._spec['integrationTests']['waitTestResultTimeout']
-                if self.check_if_tests_are_failed(max_timeout):
-                    self.update_status(
+                if await self.check_if_tests_are_failed(max_timeout):
+                    await asyncio.to_thread(
+                        self.update_status,
                         MC.Status.FAILED,
                         "Error",
                         "Mistral critical tests failed"
                     )
-                    sleep(5)
                     raise kopf.PermanentError("Mistral critical tests failed.")
                 else:
-                    self.update_status(
+                    await asyncio.to_thread(
+                        self.update_status,
                         MC.Status.SUCCESSFUL,
                         "None",
                         "Mistral service installed and tested successfully."
@@ -2914,50 +3271,55 @@ class KubernetesHelper:
                     " Detailed Integration tests result will be logged in " \
                     "mistral-operator logs and mistral-operator deployment status" \
                     " condition IntegrationTestsExecutionStatus, once it is completed."
-                self.run_tests()
-                self.update_status(
+                await self.run_tests()
+                await asyncio.to_thread(
+                    self.update_status,
                     MC.Status.SUCCESSFUL,
                     "None",
                     message
                 )
                 logger.info(message)
-                Thread(target=self.check_if_tests_are_failed).start()
+                task = asyncio.create_task(self.check_if_tests_are_failed())
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
 
-    def update_disaster_recovery_status(self, mode=None, status=None, message=None):
+    def update_disaster_recovery_status(self, mode=None, status=None, message=None,
+                                        steps=None, timings=None):
         disaster_recovery_status = {
-            key: value for key, value in zip(['mode', 'status', 'message'], [mode, status, message])
+            key: value for key, value in zip(['mode', 'status', 'message', 'steps', 'timings'],
+                                             [mode, status, message, steps, timings])
             if value is not None
         }
-        cr = self.get_custom_resource()
-        status = cr.get('status')
-        if not status:
-            status = {'disasterRecoveryStatus': disaster_recovery_status}
-        else:
-            status['disasterRecoveryStatus'] = disaster_recovery_status
-        cr['status'] = status
-        self.update_custom_resource(cr)
+        self._status_writer.set('disasterRecoveryStatus', disaster_recovery_status)
+        self._status_writer.flush()
 
-    def decode_secret(self, secret):
-        return base64.b64decode(secret).decode("utf-8")
+    def record_switchover(self, switchover):
+        """Appends the switchover summary to the history kept in the status."""
+        self._status_writer.update(
+            'switchoverHistory',
+            lambda history: ((history or []) + [switchover])
+            [-MC.SWITCHOVER_HISTORY_DEPTH:])
 
     def get_rmq_helper(self):
-        mistral_secret = self._v1_apps_api.read_namespaced_secret(MC.MISTRAL_SECRET, self._workspace)
-        mistral_secret_data = mistral_secret.data
-        rabbit_user = self.decode_secret(mistral_secret_data["rabbit-user"])
-        rabbit_password = self.decode_secret(mistral_secret_data["rabbit-password"])
-        admin_user = self.decode_secret(mistral_secret_data["rabbit-admin-user"])
-        admin_password = self.decode_secret(mistral_secret_data["rabbit-admin-password"])
+        if self._rmq_helper is not None:
+            return self._rmq_helper
+        mistral_secret_data = self._snapshot.get_secret_data(MC.MISTRAL_SECRET)
+        rabbit_user = mistral_secret_data["rabbit-user"]
+        rabbit_password = mistral_secret_data["rabbit-password"]
+        admin_user = mistral_secret_data["rabbit-admin-user"]
+        admin_password = mistral_secret_data["rabbit-admin-password"]
         rabbit_host = self._spec['mistralCommonParams']["rabbit"]["host"]
         rabbit_vhost = self._spec['mistralCommonParams']["rabbit"]["vhost"]
         queue_name_prefix = self._spec['mistralCommonParams']["queueNamePrefix"]
-        return RabbitMQHelper(rabbit_host=rabbit_host,
-                              rabbit_vhost=rabbit_vhost,
-                              rabbit_user=rabbit_user,
-                              rabbit_password=rabbit_password,
-                              admin_user=admin_user,
-                              admin_password=admin_password,
-                              queue_name_prefix=queue_name_prefix
-                              )
+        self._rmq_helper = RabbitMQHelper(rabbit_host=rabbit_host,
+                                          rabbit_vhost=rabbit_vhost,
+                                          rabbit_user=rabbit_user,
+                                          rabbit_password=rabbit_password,
+                                          admin_user=admin_user,
+                                          admin_password=admin_password,
+                                          queue_name_prefix=queue_name_prefix
+                                          )
+        return self._rmq_helper
 
     def create_rabbit_credentials(self):
         rq_helper = self.get_rmq_helper()
@@ -2967,7 +3329,8 @@ class KubernetesHelper:
 
     def delete_existing_queues(self):
         rq_helper = self.get_rmq_helper()
-        rq_helper.delete_existing_queues()
+        with get_switchover_lane().write_guard():
+            rq_helper.delete_existing_queues()
 
     def check_if_rmq_exchange_durable(self):
         rq_helper = self.get_rmq_helper()
@@ -153,11 +153,23 @@ LOGLEVEL = os.environ.get('LOGLEVEL', 'INFO').upper()
 CR_VERSION = "v2"
 CR_GROUP = "qubership.org"
 CR_PLURAL = "mistralservices"
+CR_KIND = "mistralservice"
 CR_NAME = "mistral-service"
+SPEC_HASH_ANNOTATION = "mistral.qubership.org/spec-hash"
+FIELD_MANAGER = "mistral-operator"
+# Field managers of the client-side writes of the previous operator versions,
+# their fields are handed over to FIELD_MANAGER before the first apply
+LEGACY_FIELD_MANAGERS = os.getenv(
+    "LEGACY_FIELD_MANAGERS", "OpenAPI-Generator").split(',')
+# Field managers whose ownership of the deployment replicas is respected
+EXTERNAL_REPLICAS_MANAGERS = os.getenv(
+    "EXTERNAL_REPLICAS_MANAGERS", "kube-controller-manager").split(',')
 ALPH = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789@#~=_!"
 POSITIVE_VALUES = ('true', 'True', 'yes', 'Yes')
 OPERATOR_NEED_TO_DELETE_RESOURCES = os.getenv(
     "OPERATOR_DELETE_RESOURCES", "False")
+# The operator ID is the hash of the operator image
+OPERATOR_VERSION = os.getenv("OPERATOR_VERSION", os.getenv("OPERATOR_ID", ""))
 IDP_SECRET_API_GROUP = os.getenv(
     "IDP_SECRET_API_GROUP", "qubership.org")
 ADDITIONAL_CONFIGS_FILE_PATH = 'custom-mistral-service.conf'
@@ -192,6 +204,34 @@ SERVICES_NAME_TO_SERVER = {'mistral-api': 'Api',
                            'mistral-executor': 'Executor',
                            'mistral-monitoring': 'Monitoring',
                            'mistral-engine': 'Engine'}
+# Mistral services are started only after the database schema is migrated
+MISTRAL_ROLLOUT_DEPENDENCIES = {service: [UPDATE_DB_JOB]
+                                for service in MISTRAL_SERVICES}
+RABBITMQ_RESOURCES = 'rabbitmq'
+CONFIGURATION_RESOURCES = [COMMON_CONFIGMAP, RABBITMQ_RESOURCES] + MISTRAL_SERVICES
+RECONCILE_RESOURCES = CONFIGURATION_RESOURCES + [UPDATE_DB_JOB]
+# Reconcile steps checkpointed in the status besides the resources above
+PURGE_QUEUES_STEP = 'purge-queues'
+SERVICES_STEP = 'services'
+# CR spec paths to the resources they influence, the longest matching path
+# wins. A change of a path which is not listed reconciles all the resources.
+SPEC_PATH_RESOURCES = {
+    ('mistral', 'dockerImage'): [UPDATE_DB_JOB] + MISTRAL_SERVICES,
+    ('mistral', 'lastUpdate'): CONFIGURATION_RESOURCES,
+    ('mistralCommonParams',): CONFIGURATION_RESOURCES,
+    ('mistralCommonParams', 'postgres'): RECONCILE_RESOURCES,
+    ('mistralCommonParams', 'dbaas'): RECONCILE_RESOURCES,
+    ('mistralApi',): ['mistral-api'],
+    ('mistralEngine',): ['mistral-engine'],
+    ('mistralExecutor',): ['mistral-executor'],
+    ('mistralNotifier',): ['mistral-notifier'],
+    ('mistralMonitoring',): ['mistral-monitoring'],
+    ('mistralUpdateDbPod',): [],
+    ('mistralUpdateDbPod', 'forceMigration'): [UPDATE_DB_JOB],
+    ('mistralCleanupDbPod',): [],
+    ('integrationTests',): [],
+    ('disasterRecovery',): [],
+}
 DEFAULT_VHOST = '/'
 
 if os.path.exists('/opt/operator/mount_secrets'):
@@ -204,4 +244,58 @@ else:
 
 
 MISTRAL_SCALE_DOWN_IDP_PARAMS = ["enable", "type", "idpServer", "idpExternalServer"]
+# Keys of the Mistral secret whose change requires the scale down
+SCALE_DOWN_SECRET_KEYS = ["idp-client-id", "idp-client-secret",
+                          "idp-jwk-exp", "idp-jwk-mod"]
 
+CACHE_WATCH_TIMEOUT = int(os.getenv("CACHE_WATCH_TIMEOUT", "300"))
+CACHE_RELIST_DELAY = int(os.getenv("CACHE_RELIST_DELAY", "5"))
+CACHE_LIST_PAGE_SIZE = 500
+# Only the deployments the operator creates are watched
+DEPLOYMENTS_LABEL_SELECTOR = f"app in ({MISTRAL_LABEL},{MISTRAL_TESTS})"
+
+
+JOB_WAIT_TIMEOUT = int(os.getenv("JOB_WAIT_TIMEOUT", "720"))
+DELETION_WAIT_TIMEOUT = int(os.getenv("DELETION_WAIT_TIMEOUT", "300"))
+OPERATOR_ID_RETRY_DELAY = 90
+SWITCHOVER_RETRY_DELAY = 10
+SWITCHOVER_CHECK_INTERVAL = 60
+SWITCHOVER_HISTORY_DEPTH = int(os.getenv("SWITCHOVER_HISTORY_DEPTH", "10"))
+# Disaster recovery modes in which the Mistral deployments are scaled down
+SCALED_DOWN_DR_MODES = ('standby', 'disable')
+# Retry policies per operation class, the waits woken up by the watch use
+# only the deadline and the maximal delay before the handler is retried
+RETRY_POLICIES = {
+    'job': {'initialDelay': 5, 'multiplier': 2, 'maxDelay': 60,
+            'jitter': 0.1, 'deadline': JOB_WAIT_TIMEOUT},
+    'deletion': {'initialDelay': 3, 'multiplier': 2, 'maxDelay': 30,
+                 'jitter': 0.1, 'deadline': DELETION_WAIT_TIMEOUT},
+    'scaleDown': {'initialDelay': 5, 'multiplier': 2, 'maxDelay': 30,
+                  'jitter': 0.1, 'deadline': 60},
+    'scaleUp': {'initialDelay': 5, 'multiplier': 2, 'maxDelay': 30,
+                'jitter': 0.1, 'deadline': 120},
+    'tests': {'initialDelay': 2, 'multiplier': 1.5, 'maxDelay': 30,
+              'jitter': 0.1, 'deadline': None},
+    'watch': {'initialDelay': CACHE_RELIST_DELAY, 'multiplier': 2,
+              'maxDelay': 60, 'jitter': 0.2, 'deadline': None},
+}
+STATUS_UPDATE_ATTEMPTS = 3
+STATUS_CONDITIONS_DEPTH = int(os.getenv("STATUS_CONDITIONS_DEPTH", "10"))
+STATUS_MESSAGE_LIMIT = 1024
+JOB_LOGS_LIMIT = 512 * 1024
+# Jobs whose failure logs are kept in the <job>-logs config maps
+LOGGED_JOBS = [UPDATE_DB_JOB, CLEANUP_JOB, MISTRAL_DR_JOB]
+KUBE_CONNECTION_POOL_SIZE = int(os.getenv("KUBE_CONNECTION_POOL_SIZE", "20"))
+RABBIT_CONNECT_TIMEOUT = float(os.getenv("RABBIT_CONNECT_TIMEOUT", "5"))
+RABBIT_READ_TIMEOUT = float(os.getenv("RABBIT_READ_TIMEOUT", "30"))
+RABBIT_REQUEST_RETRIES = int(os.getenv("RABBIT_REQUEST_RETRIES", "3"))
+RABBIT_RETRY_BACKOFF = 0.5
+RABBIT_QUEUES_PAGE_SIZE = 500
+RABBIT_DELETE_PARALLELISM = int(os.getenv("RABBIT_DELETE_PARALLELISM", "8"))
+RABBIT_POOL_SIZE = RABBIT_DELETE_PARALLELISM + 2
+IDP_CONNECT_TIMEOUT = float(os.getenv("IDP_CONNECT_TIMEOUT", "5"))
+IDP_READ_TIMEOUT = float(os.getenv("IDP_READ_TIMEOUT", "15"))
+IDP_REQUEST_RETRIES = int(os.getenv("IDP_REQUEST_RETRIES", "2"))
+IDP_RETRY_BACKOFF = 0.5
+IDP_RETRY_DELAY = 30
+IDP_JWK_TTL = int(os.getenv("IDP_JWK_TTL", "3600"))
@@ -3,9 +3,16 @@ Module to handle all the kubernetes operations
 """
 
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from requests import auth
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+import mistral_constants as MC
 from mistral_constants import DEFAULT_VHOST
 
 LOG = logging.getLogger(__name__)
@@ -21,6 +28,25 @@ class RabbitMQHelper(object):
         self._admin_user = admin_user
         self._admin_password = admin_password
         self._queue_name_prefix = queue_name_prefix
+        self._session = self._create_session()
+        self._latencies = {}
+        self._latencies_lock = threading.Lock()
+
+    def _create_session(self):
+        retries = Retry(
+            total=MC.RABBIT_REQUEST_RETRIES,
+            backoff_factor=MC.RABBIT_RETRY_BACKOFF,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=MC.RABBIT_POOL_SIZE,
+                              max_retries=retries)
+        session = requests.Session()
+        session.auth = (self._admin_user, self._admin_password)
+        session.mount('http://', adapter)
+        return session
 
     def create_rabbit_vhost(self):
         if self._vhost == DEFAULT_VHOST:
@@ -67,23 +93,41 @@ class RabbitMQHelper(object):
         LOG.info(
             'Add {} permissions to {} vhost'.format(self._user, vhost))
 
-    def delete_existing_queues(self):
-        vhost = '%2f' if self._vhost == DEFAULT_VHOST else self._vhost
-        res = self.request(
-            url='queues/{vhost}'.format(vhost=vhost),
-            method='GET'
-        )
+    def find_mistral_queues(self, vhost):
+        """Returns the names of the Mistral queues in the vhost.
 
-        res.raise_for_status()
-
-        queues_to_delete = []
-
-        LOG.info(
-            "Searching for existing mistral "
-            "queues in {} vhost with {} prefix".format(
-                vhost, self._queue_name_prefix
+        The broker filters the queues by the prefix and returns only their
+        names, page by page.
+        """
+        queues = []
+        page = 1
+        while True:
+            res = self.request(
+                url='queues/{vhost}'.format(vhost=vhost),
+                method='GET',
+                params={
+                    'page': page,
+                    'page_size': MC.RABBIT_QUEUES_PAGE_SIZE,
+                    'name': '^' + re.escape(self._queue_name_prefix),
+                    'use_regex': 'true',
+                    'columns': 'name',
+                }
             )
-        )
+            res.raise_for_status()
+            body = res.json()
+            if isinstance(body, list):
+                # The broker ignored the paging and returned all the queues
+                queues.extend(queue['name'] for queue in body)
+                break
+            items = body.get('items', [])
+            queues.extend(queue['name'] for queue in items)
+            page_count = body.get('page_count')
+            # Without the page count a short page is the last one
+            if page_count is not None and page >= page_count \
+                    or page_count is None \
+                    and len(items) < MC.RABBIT_QUEUES_PAGE_SIZE:
+                break
+            page += 1
 
         def _is_mistral_queue(name):
             if not name.startswith(self._queue_name_prefix):
@@ -92,51 +136,80 @@ class RabbitMQHelper(object):
                 return False
             return True
 
-        for queue in res.json():
-            if _is_mistral_queue(queue['name']):
-                queues_to_delete.append(queue['name'])
+        return [name for name in queues if _is_mistral_queue(name)]
 
-        if not queues_to_delete:
-            LOG.info('There are no queues to delete.')
-
-            LOG.info('Delete openstack exchange')
-
-            res = self.request(
-                url='exchanges/{vhost}/openstack'.format(
-                    vhost=vhost
-                ),
-                method='DELETE'
-            )
-
-            return
+    def delete_queue(self, vhost, name):
+        res = self.request(
+            url='queues/{vhost}/{name}'.format(
+                vhost=vhost, name=name
+            ),
+            method='DELETE'
+        )
+        res.raise_for_status()
 
-        LOG.info('Founded queues to delete: {}'.format(str(queues_to_delete)))
+    def delete_existing_queues(self):
+        vhost = '%2f' if self._vhost == DEFAULT_VHOST else self._vhost
 
-        for queue in queues_to_delete:
-            res = self.request(
-                url='queues/{vhost}/{name}'.format(
-                    vhost=vhost, name=queue
-                ),
-                method='DELETE'
+        LOG.info(
+            "Searching for existing mistral "
+            "queues in {} vhost with {} prefix".format(
+                vhost, self._queue_name_prefix
             )
-            res.raise_for_status()
+        )
+        started = time.monotonic()
+        queues_to_delete = self.find_mistral_queues(vhost)
+        search_time = time.monotonic() - started
 
-        LOG.info('Queues were deleted.')
+        if not queues_to_delete:
+            LOG.info('There are no queues to delete.')
+        else:
+            LOG.info('Founded queues to delete: {}'.format(str(queues_to_delete)))
+            with ThreadPoolExecutor(
+                    max_workers=MC.RABBIT_DELETE_PARALLELISM) as executor:
+                for future in [executor.submit(self.delete_queue, vhost, queue)
+                               for queue in queues_to_delete]:
+                    future.result()
+            LOG.info('Queues were deleted.')
+        delete_time = time.monotonic() - started - search_time
 
         LOG.info('Delete openstack exchange')
 
-        res = self.request(
+        self.request(
             url='exchanges/{vhost}/openstack'.format(
                 vhost=vhost
             ),
             method='DELETE'
         )
-
-    def request(self, url, method='PUT', json=None):
-        res = requests.request(
-            url='http://' + self._host + ':15672/api/' + url,
-            method=method,
-            auth=auth.HTTPBasicAuth(self._admin_user, self._admin_password),
-            json=json)
+        LOG.info('Queue cleanup took {:.2f}s: search {:.2f}s, deletion of {}'
+                 ' queues {:.2f}s'.format(time.monotonic() - started,
+                                          search_time, len(queues_to_delete),
+                                          delete_time))
+
+    def request(self, url, method='PUT', json=None, params=None):
+        endpoint = '{} {}'.format(method, url.split('/')[0])
+        started = time.monotonic()
+        try:
+            res = self._session.request(
+                url='http://' + self._host + ':15672/api/' + url,
+                method=method,
+                json=json,
+                params=params,
+                timeout=(MC.RABBIT_CONNECT_TIMEOUT, MC.RABBIT_READ_TIMEOUT))
+        finally:
+            elapsed = time.monotonic() - started
+            with self._latencies_lock:
+                stats = self._latencies.setdefault(
+                    endpoint, {'calls': 0, 'seconds': 0.0})
+                stats['calls'] += 1
+                stats['seconds'] += elapsed
 
         return res
+
+    def get_latency_stats(self):
+        """Returns the number of calls and their total time per endpoint."""
+        with self._latencies_lock:
+            return {
+                endpoint: {'calls': stats['calls'],
+                           'seconds': round(stats['seconds'], 3)}
+                for endpoint, stats in self._latencies.items()
+            }
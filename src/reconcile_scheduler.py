@@ -0,0 +1,39 @@
+"""
+Module to run reconcile steps concurrently according to their dependencies
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def run_steps(steps: dict, dependencies: dict):
+    """Runs every step as soon as all of its dependencies are finished.
+
+    :param steps: step name to a coroutine function without arguments.
+    :param dependencies: step name to the names of the steps it waits for.
+        Dependencies which are not part of ``steps`` are ignored.
+
+    A failed step fails all the steps depending on it. The first error is
+    raised after the remaining steps are cancelled.
+    """
+    tasks = {}
+
+    async def run(name):
+        required = [tasks[dependency]
+                    for dependency in dependencies.get(name, ())
+                    if dependency in tasks]
+        if required:
+            await asyncio.gather(*required)
+        logger.debug("Starting reconcile step %s", name)
+        return await steps[name]()
+
+    for name in steps:
+        tasks[name] = asyncio.ensure_future(run(name))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
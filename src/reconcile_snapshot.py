@@ -0,0 +1,64 @@
+"""
+Module with the objects read once per reconcile
+"""
+import base64
+import logging
+import threading
+
+from kubernetes.client.rest import ApiException
+
+logger = logging.getLogger(__name__)
+
+
+class ReconcileSnapshot:
+    """Objects the reconcile reads, loaded once and shared by all the steps.
+
+    Objects are taken from the watch-fed cache when it knows them and read
+    from the API server otherwise. Secrets are decoded once. An object is
+    loaded again only after the operator wrote it itself.
+    """
+
+    def __init__(self, cache, read_funcs, namespace):
+        self._cache = cache
+        self._read_funcs = read_funcs
+        self._namespace = namespace
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._secrets = {}
+
+    def get(self, kind, name):
+        """Returns the object, None if it does not exist."""
+        with self._lock:
+            if (kind, name) in self._objects:
+                return self._objects[(kind, name)]
+        known, obj = self._cache.get(kind, name)
+        if not known:
+            try:
+                obj = self._read_funcs[kind](name, self._namespace)
+            except ApiException as exc:
+                if exc.status != 404:
+                    raise
+                obj = None
+        with self._lock:
+            self._objects[(kind, name)] = obj
+        return obj
+
+    def get_secret_data(self, name):
+        """Returns the decoded data of the secret, empty if it does not exist."""
+        with self._lock:
+            if name in self._secrets:
+                return self._secrets[name]
+        secret = self.get('secret', name)
+        data = {
+            key: base64.b64decode(value).decode('utf-8')
+            for key, value in ((secret.data or {}) if secret else {}).items()
+        }
+        with self._lock:
+            self._secrets[name] = data
+        return data
+
+    def invalidate(self, kind, name):
+        with self._lock:
+            self._objects.pop((kind, name), None)
+            if kind == 'secret':
+                self._secrets.pop(name, None)
@@ -0,0 +1,110 @@
+"""
+Module with the retry policies of the operator polling loops
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import time
+
+import mistral_constants as MC
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter and a total deadline.
+
+    The first delay is ``initial_delay``, every next one is multiplied by
+    ``multiplier`` up to ``max_delay``. Each delay is shifted randomly by up
+    to ``jitter`` of its value, so the operators do not poll in lockstep.
+    ``deadline`` limits the total time of the operation, None is unlimited.
+    """
+
+    def __init__(self, name, initial_delay, multiplier=2.0, max_delay=60.0,
+                 jitter=0.1, deadline=None):
+        self.name = name
+        self.initial_delay = float(initial_delay)
+        self.multiplier = float(multiplier)
+        self.max_delay = float(max_delay)
+        self.jitter = float(jitter)
+        self.deadline = None if deadline is None else float(deadline)
+
+    @classmethod
+    def from_params(cls, name, params):
+        return cls(
+            name,
+            initial_delay=params['initialDelay'],
+            multiplier=params.get('multiplier', 2.0),
+            max_delay=params.get('maxDelay', 60.0),
+            jitter=params.get('jitter', 0.1),
+            deadline=params.get('deadline'),
+        )
+
+    def delays(self):
+        """Yields the delays between the attempts, infinitely."""
+        delay = self.initial_delay
+        while True:
+            spread = delay * self.jitter
+            yield max(0.0, delay + random.uniform(-spread, spread))
+            delay = min(delay * self.multiplier, self.max_delay)
+
+    async def poll(self, check, deadline=None):
+        """Calls ``check`` in a thread until it returns a true value.
+
+        :param deadline: overrides the deadline of the policy.
+        Returns whether the check succeeded before the deadline and the
+        last value it returned.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        delays = self.delays()
+        while True:
+            result = await asyncio.to_thread(check)
+            if result:
+                return True, result
+            delay = next(delays)
+            if deadline is not None:
+                remaining = deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    logger.debug("Retry deadline of %s is reached", self.name)
+                    return False, result
+                delay = min(delay, remaining)
+            await asyncio.sleep(delay)
+
+
+@functools.lru_cache(maxsize=None)
+def _env_params(name):
+    """Returns the parameters of the ``RETRY_POLICY_<NAME>`` variable.
+
+    A malformed value is logged and ignored, so it does not stop the
+    operator.
+    """
+    variable = f"RETRY_POLICY_{name.upper()}"
+    value = os.getenv(variable)
+    if not value:
+        return {}
+    try:
+        params = json.loads(value)
+        RetryPolicy.from_params(name, dict(MC.RETRY_POLICIES[name], **params))
+    except (ValueError, TypeError) as exc:
+        logger.error("Ignoring malformed %s %r, the default policy is used:"
+                     " %s", variable, value, exc)
+        return {}
+    return params
+
+
+def get_retry_policy(name, spec=None):
+    """Returns the retry policy of the operation class.
+
+    The defaults from the constants are overridden by the
+    ``RETRY_POLICY_<NAME>`` environment variable and then by the
+    ``retryPolicies.<name>`` section of the custom resource.
+    """
+    params = dict(MC.RETRY_POLICIES[name])
+    params.update(_env_params(name))
+    if spec:
+        params.update((spec.get('retryPolicies') or {}).get(name) or {})
+    return RetryPolicy.from_params(name, params)
@@ -0,0 +1,164 @@
+"""
+Module to write the status of the Mistral custom resource
+"""
+import copy
+import logging
+import threading
+
+from kubernetes.client.rest import ApiException
+
+import mistral_constants as MC
+
+logger = logging.getLogger(__name__)
+
+
+class StatusWriter:
+    """Buffers the status changes made while a handler runs.
+
+    The changes are sent to the status subresource as one merge patch on
+    flush. The patch carries the resourceVersion the status was read at,
+    so a concurrent write is not overwritten: on conflict the status is
+    read again and the buffered changes are reapplied on top of it. Fields
+    changed with ``update`` are rebuilt from the status read again, so the
+    entries added concurrently to lists and maps are kept.
+
+    Conditions are kept as a ring buffer of STATUS_CONDITIONS_DEPTH
+    entries, a repeated condition replaces the previous one and counts the
+    repeats.
+    """
+
+    def __init__(self, custom_objects_api, namespace, name=MC.CR_NAME):
+        self._api = custom_objects_api
+        self._namespace = namespace
+        self._name = name
+        self._lock = threading.Lock()
+        self._resource_version = None
+        self._status = None
+        self._reset_conditions = False
+        self._new_conditions = []
+        self._fields = {}
+        self._updates = {}
+
+    def _load(self):
+        cr = self._api.get_namespaced_custom_object_status(
+            group=MC.CR_GROUP,
+            version=MC.CR_VERSION,
+            namespace=self._namespace,
+            plural=MC.CR_PLURAL,
+            name=self._name
+        )
+        self._resource_version = cr['metadata']['resourceVersion']
+        self._status = cr.get('status') or {}
+
+    def get_status(self):
+        """Returns the status read from the API server merged with the buffer."""
+        with self._lock:
+            if self._status is None:
+                self._load()
+            status = dict(self._status)
+            status.update(self._updated_fields())
+            status['conditions'] = self._conditions()
+            return status
+
+    def _updated_fields(self):
+        """Returns the set fields and the updated ones rebuilt from the status."""
+        fields = dict(self._fields)
+        for field, updates in self._updates.items():
+            value = copy.deepcopy(self._status.get(field))
+            for update in updates:
+                value = update(value)
+            fields[field] = value
+        return fields
+
+    def _conditions(self):
+        conditions = [] if self._reset_conditions \
+            else list(self._status.get('conditions') or [])
+        for condition in self._new_conditions:
+            conditions = self._merge_condition(conditions, condition)
+        return conditions[-MC.STATUS_CONDITIONS_DEPTH:]
+
+    @staticmethod
+    def _merge_condition(conditions, condition):
+        """Appends the condition, a repeated one is moved to the end and counted."""
+        def key(item):
+            return item.get('type'), item.get('reason'), item.get('message')
+
+        repeated = [item for item in conditions if key(item) == key(condition)]
+        count = sum(item.get('count', 1) for item in repeated) + 1
+        conditions = [item for item in conditions if key(item) != key(condition)]
+        if count > 1:
+            condition = dict(condition, count=count)
+        return conditions + [condition]
+
+    def reset_conditions(self, condition):
+        with self._lock:
+            self._reset_conditions = True
+            self._new_conditions = [condition]
+
+    def add_condition(self, condition):
+        message = condition.get('message') or ''
+        if len(message) > MC.STATUS_MESSAGE_LIMIT:
+            condition = dict(
+                condition, message=message[:MC.STATUS_MESSAGE_LIMIT] + '...')
+        with self._lock:
+            self._new_conditions.append(condition)
+
+    def set(self, field, value):
+        with self._lock:
+            self._fields[field] = value
+            self._updates.pop(field, None)
+
+    def update(self, field, func):
+        """Buffers a change of the field computed from its current value.
+
+        The function gets the current value, None if the field is absent,
+        and returns the new one. It is applied again to the status read
+        after a conflict.
+        """
+        with self._lock:
+            if field in self._fields:
+                self._fields[field] = func(self._fields[field])
+            else:
+                self._updates.setdefault(field, []).append(func)
+
+    def flush(self):
+        """Sends the buffered changes, does nothing if there are none."""
+        with self._lock:
+            if not (self._reset_conditions or self._new_conditions
+                    or self._fields or self._updates):
+                return
+            for attempt in range(MC.STATUS_UPDATE_ATTEMPTS):
+                if self._status is None:
+                    self._load()
+                patch = self._updated_fields()
+                if self._reset_conditions or self._new_conditions:
+                    patch['conditions'] = self._conditions()
+                try:
+                    cr = self._api.patch_namespaced_custom_object_status(
+                        group=MC.CR_GROUP,
+                        version=MC.CR_VERSION,
+                        namespace=self._namespace,
+                        plural=MC.CR_PLURAL,
+                        name=self._name,
+                        body={
+                            'metadata': {
+                                'resourceVersion': self._resource_version
+                            },
+                            'status': patch,
+                        }
+                    )
+                except ApiException as exc:
+                    if exc.status != 409 \
+                            or attempt == MC.STATUS_UPDATE_ATTEMPTS - 1:
+                        raise
+                    logger.info("Status of %s was changed concurrently,"
+                                " retrying", self._name)
+                    self._status = None
+                    continue
+                self._resource_version = cr['metadata']['resourceVersion']
+                self._status = cr.get('status') or {}
+                self._reset_conditions = False
+                self._new_conditions = []
+                self._fields = {}
+                self._updates = {}
+                return
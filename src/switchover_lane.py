@@ -0,0 +1,197 @@
+"""
+Module to run the disaster recovery switchover apart from the reconciles
+"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import threading
+
+import kopf
+
+import mistral_constants as MC
+
+logger = logging.getLogger(__name__)
+
+_current_phase = contextvars.ContextVar('preemptible_phase', default=None)
+
+
+class _Phase:
+    """One preemptible phase of a reconcile."""
+
+    def __init__(self):
+        self.preempted = False
+
+
+class SwitchoverLane:
+    """Lets a disaster recovery switchover preempt the regular reconciles.
+
+    kopf handles the changes of one object one after another, so a mode
+    change handled by kopf would wait behind a running rollout. The
+    switchover is started by a daemon fed by the object cache instead. The
+    long phases of the reconciles run through ``preemptible``: a starting
+    switchover cancels them and the reconcile is retried after it, resuming
+    from its checkpoints.
+
+    Cancelling a phase does not stop the worker threads it started, so the
+    writes of the phases run through ``write_guard``. A preempted phase
+    starts no new write, and the switchover waits for the writes already
+    sent before it changes anything.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._running = 0
+        self._background = None
+        self._writes = threading.Condition()
+        self._writes_in_flight = 0
+
+    @property
+    def running(self):
+        return self._running > 0
+
+    async def preemptible(self, step):
+        """Runs the coroutine function unless a switchover is running."""
+        if self.running:
+            raise kopf.TemporaryError(
+                "Disaster recovery switchover is running.",
+                delay=MC.SWITCHOVER_RETRY_DELAY)
+        phase = _Phase()
+
+        async def run():
+            # The worker threads of the phase get the context copied
+            _current_phase.set(phase)
+            return await step()
+
+        task = asyncio.ensure_future(run())
+        self._tasks[task] = phase
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if phase.preempted:
+                raise kopf.TemporaryError(
+                    "Reconcile is preempted by the disaster recovery"
+                    " switchover.", delay=MC.SWITCHOVER_RETRY_DELAY)
+            raise
+        finally:
+            self._tasks.pop(task, None)
+
+    @contextlib.contextmanager
+    def write_guard(self):
+        """Lets a write of a preemptible phase run unless it is preempted.
+
+        Used in the worker threads, writes made outside of the preemptible
+        phases, the switchover ones among them, are not guarded.
+        """
+        phase = _current_phase.get()
+        if phase is None:
+            yield
+            return
+        with self._writes:
+            if phase.preempted or self.running:
+                raise kopf.TemporaryError(
+                    "Reconcile is preempted by the disaster recovery"
+                    " switchover.", delay=MC.SWITCHOVER_RETRY_DELAY)
+            self._writes_in_flight += 1
+        try:
+            yield
+        finally:
+            with self._writes:
+                self._writes_in_flight -= 1
+                self._writes.notify_all()
+
+    def _wait_for_writes(self):
+        with self._writes:
+            if self._writes_in_flight:
+                logger.info("Waiting for %d writes of the preempted"
+                            " reconcile", self._writes_in_flight)
+            self._writes.wait_for(lambda: self._writes_in_flight == 0)
+
+    async def switchover(self, run):
+        """Cancels the preemptible phases and runs the switchover.
+
+        A switchover still running in the background is cancelled, the
+        latest requested mode wins.
+        """
+        self._cancel_background()
+        with self._writes:
+            self._running += 1
+            for phase in self._tasks.values():
+                phase.preempted = True
+        try:
+            if self._tasks:
+                logger.info("Preempting %d running reconcile phases",
+                            len(self._tasks))
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.to_thread(self._wait_for_writes)
+            return await run()
+        finally:
+            with self._writes:
+                self._running -= 1
+
+    def _cancel_background(self):
+        background = self._background
+        if background is not None and background is not asyncio.current_task():
+            background.cancel()
+
+    def start_switchover(self, run):
+        """Starts the switchover in the background and returns its task."""
+        self._cancel_background()
+        task = asyncio.ensure_future(self.switchover(run))
+        self._background = task
+        task.add_done_callback(self._log_failure)
+        return task
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Switchover failed", exc_info=task.exception())
+
+
+class SwitchoverMetrics:
+    """Durations of the switchovers handled by this operator process.
+
+    Every phase and every deployment keeps the count of observations and
+    the last, maximal and total seconds, so the RTO can be compared across
+    releases.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._results = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            duration = self._durations.setdefault(
+                name, {'count': 0, 'last': 0.0, 'max': 0.0, 'total': 0.0})
+            duration['count'] += 1
+            duration['last'] = seconds
+            duration['max'] = max(duration['max'], seconds)
+            duration['total'] = round(duration['total'] + seconds, 3)
+
+    def count_result(self, mode, status):
+        with self._lock:
+            key = f"{mode}/{status}"
+            self._results[key] = self._results.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'durations': {name: dict(duration) for name, duration
+                              in self._durations.items()},
+                'results': dict(self._results),
+            }
+
+
+_lane = SwitchoverLane()
+_metrics = SwitchoverMetrics()
+
+
+def get_switchover_lane():
+    return _lane
+
+
+def get_switchover_metrics():
+    return _metrics
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from kubernetes import client
+
+import mistral_constants as MC
+from kubernetes_helper import KubernetesHelper
+
+
+def make_helper():
+    helper = KubernetesHelper.__new__(KubernetesHelper)
+    helper._api_client = client.ApiClient(client.Configuration())
+    helper.apply_stats = dict.fromkeys(['created', 'updated', 'unchanged'], 0)
+    helper._apply_stats_lock = threading.Lock()
+    helper.get_live_object = mock.Mock()
+    helper.delete_job = mock.Mock()
+    helper.wait_for_deletion = mock.AsyncMock()
+    helper.apply_manifest = mock.Mock(return_value=True)
+    return helper
+
+
+def make_job(name='mistral-update-db', image='mistral:1'):
+    return client.V1Job(
+        metadata=client.V1ObjectMeta(name=name),
+        spec=client.V1JobSpec(template=client.V1PodTemplateSpec(
+            spec=client.V1PodSpec(containers=[
+                client.V1Container(name=name, image=image)]))))
+
+
+def make_live_job(helper, body, status):
+    live = make_job(body.metadata.name)
+    live.metadata.annotations = {
+        MC.SPEC_HASH_ANNOTATION: helper.spec_hash(body)}
+    live.status = status
+    return live
+
+
+@mock.patch('kopf.adopt', mock.Mock())
+class RecreateJobTest(unittest.TestCase):
+
+    def test_identical_running_job_is_awaited(self):
+        helper = make_helper()
+        helper.get_live_object.return_value = make_live_job(
+            helper, make_job(), client.V1JobStatus(active=1))
+
+        asyncio.run(helper.recreate_job(make_job()))
+
+        helper.delete_job.assert_not_called()
+        helper.apply_manifest.assert_not_called()
+        self.assertEqual(helper.apply_stats['unchanged'], 1)
+
+    def test_outdated_job_is_recreated(self):
+        helper = make_helper()
+        helper.get_live_object.return_value = make_live_job(
+            helper, make_job(image='mistral:0'), client.V1JobStatus(active=1))
+
+        asyncio.run(helper.recreate_job(make_job()))
+
+        helper.delete_job.assert_called_once_with('mistral-update-db')
+        helper.wait_for_deletion.assert_awaited_once_with(
+            'job', 'mistral-update-db')
+        helper.apply_manifest.assert_called_once()
+        self.assertEqual(helper.apply_stats['created'], 1)
+
+    def test_finished_job_is_recreated(self):
+        helper = make_helper()
+        helper.get_live_object.return_value = make_live_job(
+            helper, make_job(), client.V1JobStatus(succeeded=1))
+
+        asyncio.run(helper.recreate_job(make_job()))
+
+        helper.delete_job.assert_called_once_with('mistral-update-db')
+        helper.apply_manifest.assert_called_once()
+
+
+class UpgradeManagedFieldsTest(unittest.TestCase):
+
+    def test_legacy_fields_are_moved_to_the_apply_manager(self):
+        managed_fields = [
+            {'manager': 'OpenAPI-Generator', 'operation': 'Update',
+             'apiVersion': 'apps/v1', 'fieldsType': 'FieldsV1',
+             'time': '2026-01-01T00:00:00Z',
+             'fieldsV1': {'f:spec': {'f:replicas': {}, 'f:paused': {}}}},
+            {'manager': MC.FIELD_MANAGER, 'operation': 'Apply',
+             'apiVersion': 'apps/v1', 'fieldsType': 'FieldsV1',
+             'fieldsV1': {'f:spec': {'f:template': {}}}},
+            {'manager': 'kube-controller-manager', 'operation': 'Update',
+             'apiVersion': 'apps/v1', 'fieldsType': 'FieldsV1',
+             'subresource': 'status', 'fieldsV1': {'f:status': {}}},
+        ]
+
+        upgraded = KubernetesHelper.upgrade_managed_fields(
+            managed_fields, 'apps/v1')
+
+        self.assertEqual(upgraded, [
+            managed_fields[2],
+            {'manager': MC.FIELD_MANAGER, 'operation': 'Apply',
+             'apiVersion': 'apps/v1', 'fieldsType': 'FieldsV1',
+             'time': '2026-01-01T00:00:00Z',
+             'fieldsV1': {'f:spec': {'f:template': {}, 'f:replicas': {},
+                                     'f:paused': {}}}},
+        ])
+
+    def test_nothing_to_migrate(self):
+        managed_fields = [
+            {'manager': MC.FIELD_MANAGER, 'operation': 'Apply',
+             'fieldsV1': {'f:data': {}}},
+        ]
+        self.assertIsNone(KubernetesHelper.upgrade_managed_fields(
+            managed_fields, 'v1'))
+
+
+def make_pod(image, image_id, name=MC.MISTRAL_LABEL):
+    return client.V1Pod(
+        spec=client.V1PodSpec(containers=[
+            client.V1Container(name=name, image=image)]),
+        status=client.V1PodStatus(container_statuses=[
+            client.V1ContainerStatus(
+                name=name, image=image, image_id=image_id, ready=True,
+                restart_count=0)]))
+
+
+class MigrationTest(unittest.TestCase):
+
+    def make_helper(self, pods, migration):
+        helper = KubernetesHelper.__new__(KubernetesHelper)
+        helper._workspace = 'mistral'
+        helper._v1_apps_api = mock.Mock()
+        helper._v1_apps_api.list_namespaced_pod.return_value = \
+            client.V1PodList(items=pods)
+        helper._status_writer = mock.Mock()
+        helper._status_writer.get_status.return_value = {
+            'migration': migration}
+        helper.get_migration_target = mock.Mock(
+            return_value={'image': 'mistral:1', 'database': 'pg:5432/mistral'})
+        helper._spec = {'mistralUpdateDbPod': {}}
+        return helper
+
+    def test_image_digest(self):
+        self.assertEqual(
+            KubernetesHelper.get_image_digest('docker.io/mistral@sha256:ab'),
+            'sha256:ab')
+        self.assertIsNone(KubernetesHelper.get_image_digest('mistral:1'))
+        self.assertIsNone(KubernetesHelper.get_image_digest(None))
+
+    def test_rebuilt_image_is_migrated(self):
+        helper = self.make_helper(
+            [make_pod('mistral:1', 'mistral@sha256:new')],
+            {'image': 'mistral:1', 'database': 'pg:5432/mistral',
+             'imageDigests': ['sha256:old']})
+
+        self.assertTrue(helper.is_migration_needed())
+
+    def test_same_digest_is_not_migrated(self):
+        helper = self.make_helper(
+            [make_pod('mistral:1', 'mistral@sha256:old'),
+             make_pod('mistral:0', 'mistral@sha256:other')],
+            {'image': 'mistral:1', 'database': 'pg:5432/mistral',
+             'imageDigests': ['sha256:old']})
+
+        self.assertFalse(helper.is_migration_needed())
+
+    def test_record_migration_stores_job_digest(self):
+        helper = self.make_helper(
+            [make_pod('mistral:1', 'mistral@sha256:new', MC.UPDATE_DB_JOB)],
+            None)
+
+        helper.record_migration()
+
+        _, migration = helper._status_writer.set.call_args.args
+        self.assertEqual(migration['imageDigests'], ['sha256:new'])
+        helper._v1_apps_api.list_namespaced_pod.assert_any_call(
+            namespace='mistral', label_selector=f'app={MC.UPDATE_DB_JOB}',
+            timeout_seconds=10)
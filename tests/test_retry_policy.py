@@ -0,0 +1,36 @@
+import os
+import unittest
+from unittest import mock
+
+import mistral_constants as MC
+import retry_policy
+
+
+class GetRetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        retry_policy._env_params.cache_clear()
+        self.addCleanup(retry_policy._env_params.cache_clear)
+
+    def test_env_overrides_the_default(self):
+        with mock.patch.dict(os.environ,
+                             {'RETRY_POLICY_JOB': '{"deadline": 30}'}):
+            policy = retry_policy.get_retry_policy('job')
+        self.assertEqual(policy.deadline, 30)
+
+    def test_malformed_env_falls_back_to_the_default(self):
+        defaults = MC.RETRY_POLICIES['job']
+        for value in ('{deadline: 30', '[1, 2]', '{"initialDelay": "soon"}'):
+            retry_policy._env_params.cache_clear()
+            with mock.patch.dict(os.environ, {'RETRY_POLICY_JOB': value}):
+                with self.assertLogs(retry_policy.logger, 'ERROR'):
+                    policy = retry_policy.get_retry_policy('job')
+            self.assertEqual(policy.initial_delay, defaults['initialDelay'])
+            self.assertEqual(policy.deadline, defaults['deadline'])
+
+    def test_custom_resource_overrides_the_env(self):
+        spec = {'retryPolicies': {'job': {'deadline': 10}}}
+        with mock.patch.dict(os.environ,
+                             {'RETRY_POLICY_JOB': '{"deadline": 30}'}):
+            policy = retry_policy.get_retry_policy('job', spec)
+        self.assertEqual(policy.deadline, 10)
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+import unittest
+
+import kopf
+
+from switchover_lane import SwitchoverLane
+
+
+class SwitchoverLaneTest(unittest.TestCase):
+
+    def test_switchover_waits_for_writes_in_flight(self):
+        lane = SwitchoverLane()
+        write_started = threading.Event()
+        events = []
+
+        def write():
+            with lane.write_guard():
+                write_started.set()
+                time.sleep(0.2)
+                events.append('write')
+
+        async def phase():
+            await asyncio.to_thread(write)
+
+        async def switchover():
+            events.append('switchover')
+
+        async def main():
+            reconcile = asyncio.ensure_future(lane.preemptible(phase))
+            await asyncio.to_thread(write_started.wait)
+            await lane.switchover(switchover)
+            with self.assertRaises(kopf.TemporaryError):
+                await reconcile
+
+        asyncio.run(main())
+        self.assertEqual(events, ['write', 'switchover'])
+
+    def test_preempted_phase_starts_no_write(self):
+        lane = SwitchoverLane()
+        preempted = threading.Event()
+        resumed = threading.Event()
+        writes = []
+
+        def write():
+            preempted.wait()
+            try:
+                with lane.write_guard():
+                    writes.append('write')
+            finally:
+                resumed.set()
+
+        async def phase():
+            await asyncio.to_thread(write)
+
+        async def switchover():
+            preempted.set()
+            await asyncio.to_thread(resumed.wait)
+
+        async def main():
+            reconcile = asyncio.ensure_future(lane.preemptible(phase))
+            await asyncio.sleep(0.05)
+            await lane.switchover(switchover)
+            with self.assertRaises(kopf.TemporaryError):
+                await reconcile
+
+        asyncio.run(main())
+        self.assertEqual(writes, [])
+
+    def test_unguarded_outside_of_phases(self):
+        lane = SwitchoverLane()
+        with lane.write_guard():
+            pass